@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 """
-Module to securely hash and validate passwords using bcrypt.
+Module to securely hash and validate passwords.
+Uses bcrypt by default; see hashers for the other algorithms.
 """
-import bcrypt
+import hashers
 
 
 def hash_password(password: str) -> bytes:
     """
-    Hash a password with a salt using bcrypt, returning the hashed password as bytes.
+    Hash a password with a salt using the default hasher (bcrypt unless the
+    PASSWORD_HASHER environment variable names another one), returning the
+    hashed password as bytes.
 
     Args:
         password (str): The plain-text password to hash.
@@ -15,12 +18,13 @@ def hash_password(password: str) -> bytes:
     Returns:
         bytes: The salted, hashed password as a byte string.
     """
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    return hashers.hash_password(password)
 
 
 def is_valid(hashed_password: bytes, password: str) -> bool:
     """
-    Validate that a provided password matches the hashed password using bcrypt.
+    Validate that a provided password matches the hashed password, using the
+    algorithm identified by the hash prefix.
 
     Args:
         hashed_password (bytes): The hashed password to check against.
@@ -29,4 +33,4 @@ def is_valid(hashed_password: bytes, password: str) -> bool:
     Returns:
         bool: True if the password matches the hashed password, False otherwise.
     """
-    return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
+    return hashers.verify_password(password, hashed_password)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Password hashers module
+This module provides a registry of password hashing algorithms.
+Hashes are self-describing: bcrypt hashes start with $2b$ and scrypt
+hashes with $scrypt$, so verification picks the algorithm from the
+stored hash and tables mixing several algorithms keep working.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import re
+from typing import Union
+
+import bcrypt
+
+
+def _b64encode(data: bytes) -> bytes:
+    """Unpadded base64 encoding"""
+    return base64.b64encode(data).rstrip(b'=')
+
+
+def _b64decode(data: bytes) -> bytes:
+    """Decode unpadded base64
+
+    Raises:
+        ValueError: If data holds anything but base64 characters, padding
+            included
+    """
+    if b'=' in data:
+        raise ValueError("padded base64")
+    return base64.b64decode(data + b'=' * (-len(data) % 4), validate=True)
+
+
+class BcryptHasher:
+    """bcrypt hasher; CPU-hard, cost set by the number of rounds"""
+    name = 'bcrypt'
+    prefixes = (b'$2a$', b'$2b$', b'$2y$')
+
+    def __init__(self, rounds: int = 12) -> None:
+        """Initialize the hasher
+
+        Args:
+            rounds: log2 of the number of key expansion iterations
+        """
+        self.rounds = rounds
+
+    def identify(self, hashed: bytes) -> bool:
+        """Whether a hash was produced by this algorithm"""
+        return hashed.startswith(self.prefixes)
+
+    def hash(self, password: bytes) -> bytes:
+        """Hash a password with a random salt"""
+        return bcrypt.hashpw(password, bcrypt.gensalt(self.rounds))
+
+    def verify(self, password: bytes, hashed: bytes) -> bool:
+        """Check a password against a hash, with the hash's own cost"""
+        try:
+            return bcrypt.checkpw(password, hashed)
+        except ValueError:
+            return False
+
+
+class ScryptHasher:
+    """scrypt hasher from hashlib; memory-hard, using 128 * n * r bytes
+
+    Hashes are formatted as $scrypt$ln=<log2 n>,r=<r>,p=<p>$<salt>$<key>
+    with unpadded base64 salt and key. Anything else, including hashes
+    whose parameters need more than max_memory or whose key is shorter
+    than min_key_size, fails verification.
+    """
+    name = 'scrypt'
+    prefix = b'$scrypt$'
+    min_key_size = 16
+    _params = re.compile(
+        rb'ln=([1-9][0-9]?),r=([1-9][0-9]{0,5}),p=([1-9][0-9]{0,5})')
+
+    def __init__(self, n: int = 2 ** 14, r: int = 8, p: int = 1,
+                 salt_size: int = 16, key_size: int = 32,
+                 max_memory: int = 2 ** 30) -> None:
+        """Initialize the hasher
+
+        Args:
+            n: CPU/memory cost, a power of 2
+            r: Block size
+            p: Parallelization
+            salt_size: Length of the random salt in bytes
+            key_size: Length of the derived key in bytes, at least
+                min_key_size
+            max_memory: Largest number of bytes a hash may need to be
+                verified
+
+        Raises:
+            ValueError: If n is not a power of 2 greater than 1, if the key
+                is too short, or if these parameters need more than
+                max_memory
+        """
+        if n < 2 or n & (n - 1):
+            raise ValueError("n must be a power of 2 greater than 1")
+        if key_size < self.min_key_size:
+            raise ValueError(
+                f"key_size must be at least {self.min_key_size}")
+        if self._memory(n, r, p) > max_memory:
+            raise ValueError("parameters need more than max_memory")
+        self.max_memory = max_memory
+        self.n = n
+        self.r = r
+        self.p = p
+        self.salt_size = salt_size
+        self.key_size = key_size
+
+    @staticmethod
+    def _memory(n: int, r: int, p: int) -> int:
+        """Bytes scrypt needs for these parameters"""
+        return 128 * r * (n + p + 2)
+
+    @classmethod
+    def _derive(cls, password: bytes, salt: bytes, n: int, r: int, p: int,
+                key_size: int) -> bytes:
+        """Run scrypt, allowing the memory the parameters need"""
+        maxmem = cls._memory(n, r, p) + 1024 * 1024
+        return hashlib.scrypt(password, salt=salt, n=n, r=r, p=p,
+                              maxmem=maxmem, dklen=key_size)
+
+    def identify(self, hashed: bytes) -> bool:
+        """Whether a hash was produced by this algorithm"""
+        return hashed.startswith(self.prefix)
+
+    def hash(self, password: bytes) -> bytes:
+        """Hash a password with a random salt"""
+        salt = os.urandom(self.salt_size)
+        key = self._derive(password, salt, self.n, self.r, self.p,
+                           self.key_size)
+        params = 'ln={},r={},p={}'.format(
+            self.n.bit_length() - 1, self.r, self.p).encode('ascii')
+        return b'$'.join([self.prefix[:-1], params,
+                          _b64encode(salt), _b64encode(key)])
+
+    def verify(self, password: bytes, hashed: bytes) -> bool:
+        """Check a password against a hash, with the hash's own parameters"""
+        fields = hashed.split(b'$')
+        if len(fields) != 5 or fields[:2] != [b'', self.name.encode()]:
+            return False
+        params = self._params.fullmatch(fields[2])
+        if params is None:
+            return False
+        ln, r, p = (int(value) for value in params.groups())
+        if self._memory(1 << ln, r, p) > self.max_memory:
+            return False
+        try:
+            salt = _b64decode(fields[3])
+            key = _b64decode(fields[4])
+            if not salt or len(key) < self.min_key_size:
+                return False
+            derived = self._derive(password, salt, 1 << ln, r, p, len(key))
+        except (ValueError, MemoryError):
+            return False
+        return hmac.compare_digest(derived, key)
+
+
+_hashers = {}
+_default = os.getenv('PASSWORD_HASHER', 'bcrypt')
+
+
+def register_hasher(hasher, default: bool = False) -> None:
+    """Add a hasher to the registry, replacing one with the same name
+
+    Args:
+        hasher: Object with name, identify, hash and verify
+        default: Use it to hash new passwords
+    """
+    global _default
+    _hashers[hasher.name] = hasher
+    if default:
+        _default = hasher.name
+
+
+def get_hasher(name: str = None):
+    """Get a registered hasher
+
+    Args:
+        name: Name of the hasher, the default one if None
+
+    Raises:
+        KeyError: If no hasher has this name
+    """
+    return _hashers[name or _default]
+
+
+def hash_password(password: str, name: str = None) -> bytes:
+    """Hash a password
+
+    Args:
+        password: The plain-text password
+        name: Name of the hasher, the default one if None
+
+    Returns:
+        The self-describing hash
+    """
+    return get_hasher(name).hash(password.encode('utf-8'))
+
+
+def verify_password(password: str, hashed: Union[bytes, str]) -> bool:
+    """Check a password against a hash of any registered algorithm
+
+    Args:
+        password: The plain-text password
+        hashed: The stored hash
+
+    Returns:
+        True if the password matches, False otherwise or if no hasher
+        recognizes the hash
+    """
+    if isinstance(hashed, str):
+        hashed = hashed.encode('utf-8')
+    for hasher in _hashers.values():
+        if hasher.identify(hashed):
+            return hasher.verify(password.encode('utf-8'), hashed)
+    return False
+
+
+register_hasher(BcryptHasher())
+register_hasher(ScryptHasher())
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Tests for the password hashers module
+Run from the project directory: python -m unittest discover tests
+"""
+import importlib
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hashers  # noqa: E402
+from hashers import BcryptHasher, ScryptHasher  # noqa: E402
+
+
+class TestRoundTrip(unittest.TestCase):
+    """Each hasher verifies its own hashes and nothing else"""
+
+    def check(self, hasher) -> None:
+        """Hash, verify and reject wrong passwords"""
+        for password in (b'secret', b'', 'päss \U0001f511'.encode()):
+            hashed = hasher.hash(password)
+            self.assertTrue(hasher.identify(hashed))
+            self.assertTrue(hasher.verify(password, hashed))
+            self.assertFalse(hasher.verify(password + b'x', hashed))
+            self.assertNotEqual(hasher.hash(password), hashed)
+
+    def test_bcrypt(self) -> None:
+        """bcrypt round trip"""
+        self.check(BcryptHasher(rounds=4))
+
+    def test_scrypt(self) -> None:
+        """scrypt round trip, with default and custom parameters"""
+        self.check(ScryptHasher())
+        self.check(ScryptHasher(n=2 ** 10, r=4, p=2, salt_size=8,
+                                key_size=16))
+
+    def test_scrypt_format(self) -> None:
+        """scrypt hashes carry their parameters"""
+        hashed = ScryptHasher(n=2 ** 10, r=4, p=2).hash(b'pw')
+        self.assertRegex(hashed, rb'^\$scrypt\$ln=10,r=4,p=2\$'
+                                 rb'[A-Za-z0-9+/]{22}\$[A-Za-z0-9+/]{43}$')
+
+
+class TestRegistry(unittest.TestCase):
+    """Verification picks the algorithm from the stored hash"""
+
+    def test_mixed_table(self) -> None:
+        """A table mixing algorithms and scrypt settings verifies fully"""
+        table = {
+            'bcrypt': BcryptHasher(rounds=4).hash(b'bcrypt'),
+            'bcrypt-default': hashers.hash_password('bcrypt-default',
+                                                    'bcrypt'),
+            'scrypt': hashers.hash_password('scrypt', 'scrypt'),
+            'scrypt-small': ScryptHasher(n=2 ** 10, r=4).hash(b'scrypt-small'),
+            'scrypt-p3': ScryptHasher(n=2 ** 11, r=2, p=3,
+                                      key_size=64).hash(b'scrypt-p3'),
+        }
+        for password, hashed in table.items():
+            self.assertTrue(hashers.verify_password(password, hashed))
+            self.assertTrue(hashers.verify_password(password,
+                                                    hashed.decode()))
+            for other in table:
+                if other != password:
+                    self.assertFalse(hashers.verify_password(other, hashed))
+
+    def test_malformed_hashes(self) -> None:
+        """Malformed and unknown hashes fail verification without raising
+        and without an expensive derivation"""
+        good = hashers.hash_password('pw', 'scrypt').decode()
+        _, _, params, salt, key = good.split('$')
+        self.assertTrue(hashers.verify_password('pw', good))
+        malformed = [
+            '', 'pw', '$', '$$$$', '$unknown$pw', '$2b$', '$2b$12$garbage',
+            '$1$salt$hash', '$scrypt$', '$scrypt$' + params,
+            f'$scrypt${params}${salt}${key}$',
+            f'x$scrypt${params}${salt}${key}',
+            f'$scrypt$ln=-1,r=8,p=1${salt}${key}',
+            f'$scrypt$ln=0,r=8,p=1${salt}${key}',
+            f'$scrypt$ln=99,r=8,p=1${salt}${key}',
+            f'$scrypt$ln={10 ** 12},r=8,p=1${salt}${key}',
+            f'$scrypt$ln=30,r=8,p=1${salt}${key}',
+            f'$scrypt$ln=14,r=0,p=1${salt}${key}',
+            f'$scrypt$ln=14,r=8,p=0${salt}${key}',
+            f'$scrypt$ln=14,r=8,p=1,ln=10${salt}${key}',
+            f'$scrypt$ln=14,ln=14,r=8,p=1${salt}${key}',
+            f'$scrypt$r=8,ln=14,p=1${salt}${key}',
+            f'$scrypt$ln=14,r=8,p=1,x=1${salt}${key}',
+            f'$scrypt$ln=+14,r=8,p=1${salt}${key}',
+            f'$scrypt$ln= 14,r=8,p=1${salt}${key}',
+            f'$scrypt$ln=014,r=8,p=1${salt}${key}',
+            f'$scrypt$ln=١٤,r=8,p=1${salt}${key}',
+            f'$scrypt$ln14,r=8,p=1${salt}${key}',
+            f'$scrypt${params}${salt}$',
+            f'$scrypt${params}$${key}',
+            f'$scrypt${params}$!!!{salt}${key}',
+            f'$scrypt${params}${salt}${key}=',
+            f'$scrypt${params}${salt}${key[:20]}',
+        ]
+        started = time.monotonic()
+        for hashed in malformed:
+            self.assertFalse(hashers.verify_password('pw', hashed), hashed)
+            self.assertFalse(hashers.verify_password('pw', hashed.encode()),
+                             hashed)
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_parameter_limits(self) -> None:
+        """Bad parameters and those beyond max_memory are refused up
+        front"""
+        with self.assertRaises(ValueError):
+            ScryptHasher(n=2 ** 20, r=8)
+        big = ScryptHasher(n=2 ** 14, r=8, max_memory=2 ** 25)
+        hashed = big.hash(b'pw')
+        self.assertTrue(big.verify(b'pw', hashed))
+        small = ScryptHasher(n=2 ** 10, r=8, max_memory=2 ** 21)
+        self.assertFalse(small.verify(b'pw', hashed))
+        with self.assertRaises(ValueError):
+            ScryptHasher(n=3)
+        with self.assertRaises(ValueError):
+            ScryptHasher(key_size=8)
+
+    def test_register_default(self) -> None:
+        """register_hasher(default=True) selects the hasher for new
+        passwords, and the others keep verifying"""
+        class Plain:
+            name = 'plain'
+
+            def identify(self, hashed: bytes) -> bool:
+                return hashed.startswith(b'$plain$')
+
+            def hash(self, password: bytes) -> bytes:
+                return b'$plain$' + password
+
+            def verify(self, password: bytes, hashed: bytes) -> bool:
+                return hashed == self.hash(password)
+
+        old_bcrypt = hashers.hash_password('pw')
+        with mock.patch.dict(hashers._hashers), \
+                mock.patch.object(hashers, '_default', hashers._default):
+            hashers.register_hasher(Plain(), default=True)
+            self.assertIsInstance(hashers.get_hasher(), Plain)
+            self.assertEqual(hashers.hash_password('pw'), b'$plain$pw')
+            self.assertTrue(hashers.verify_password('pw', b'$plain$pw'))
+            self.assertTrue(hashers.verify_password('pw', old_bcrypt))
+        self.assertEqual(hashers.get_hasher().name, 'bcrypt')
+        self.assertFalse(hashers.verify_password('pw', b'$plain$pw'))
+        with self.assertRaises(KeyError):
+            hashers.get_hasher('plain')
+
+    def test_password_hasher_variable(self) -> None:
+        """PASSWORD_HASHER picks the default hasher at import"""
+        try:
+            with mock.patch.dict(os.environ, {'PASSWORD_HASHER': 'scrypt'}):
+                importlib.reload(hashers)
+            self.assertEqual(hashers.get_hasher().name, 'scrypt')
+            self.assertTrue(hashers.hash_password('pw').startswith(
+                b'$scrypt$'))
+            with mock.patch.dict(os.environ, {'PASSWORD_HASHER': 'nope'}):
+                importlib.reload(hashers)
+            with self.assertRaises(KeyError):
+                hashers.hash_password('pw')
+        finally:
+            importlib.reload(hashers)
+        self.assertTrue(hashers.hash_password('pw').startswith(b'$2b$'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,9 +7,11 @@ import os
 from flask import Flask, jsonify, abort, request
 from api.v1.views import app_views
 from api.v1.auth.auth import Auth
+from api.v1.profiling import install_profiler
 
 app = Flask(__name__)
 app.register_blueprint(app_views)
+install_profiler(app)
 
 # Initialize auth based on AUTH_TYPE environment variable
 auth = None
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Regression tests for the per-request profiling hook.
+Run from the project directory: python -m unittest discover tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.v1.app import app  # noqa: E402
+from api.v1.profiling import ProfilerMiddleware  # noqa: E402
+
+
+class TestProfilerMiddleware(unittest.TestCase):
+    """
+    Profiled requests get the same response as unprofiled ones, whatever
+    happens to the profile file.
+    """
+
+    def setUp(self):
+        """
+        Profile every request into a fresh directory.
+        """
+        self._wsgi_app = app.wsgi_app
+        self.profile_dir = tempfile.mkdtemp()
+        app.wsgi_app = ProfilerMiddleware(self._wsgi_app, self.profile_dir,
+                                          token='secret', sample_rate=1.0,
+                                          max_files=3)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """
+        Restore the app and remove the profiles.
+        """
+        app.wsgi_app = self._wsgi_app
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+    def unprofiled_status(self, path):
+        """
+        Returns the status code of a request served without the profiler.
+        """
+        profiled, app.wsgi_app = app.wsgi_app, self._wsgi_app
+        try:
+            return self.client.get(path).status_code
+        finally:
+            app.wsgi_app = profiled
+
+    def profiles(self):
+        """
+        Returns the profile files written so far.
+        """
+        return [name for name in os.listdir(self.profile_dir)
+                if name.endswith('.prof')]
+
+    def test_profile_written(self):
+        """
+        A profiled request succeeds and leaves a .prof file.
+        """
+        response = self.client.get('/api/v1/status')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {"status": "OK"})
+        self.assertEqual(len(self.profiles()), 1)
+
+    def test_long_path(self):
+        """
+        A 300-character path does not produce a too-long file name.
+        """
+        path = '/api/v1/' + 'a' * 300
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, self.unprofiled_status(path))
+        names = self.profiles()
+        self.assertEqual(len(names), 1)
+        self.assertLess(len(names[0]), 140)
+
+    def test_unsafe_characters(self):
+        """
+        NUL bytes, dots and slashes in the path stay out of the file name.
+        """
+        for path in ('/api/v1/%00x', '/api/v1/../../etc/passwd',
+                     '/api/v1/caf%C3%A9%20\\..'):
+            response = self.client.get(path)
+            self.assertEqual(response.status_code,
+                             self.unprofiled_status(path), path)
+        for name in self.profiles():
+            self.assertRegex(name, r'^[0-9]+\.[0-9]+\.[A-Za-z0-9_.-]+\.prof$')
+            self.assertNotIn('..', name)
+
+    def test_unwritable_directory(self):
+        """
+        A missing profile directory loses the profile, not the response.
+        """
+        shutil.rmtree(self.profile_dir)
+        response = self.client.get('/api/v1/status')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(os.path.exists(self.profile_dir))
+
+    def test_max_files(self):
+        """
+        Only the newest max_files profiles are kept.
+        """
+        for _ in range(6):
+            self.client.get('/api/v1/status')
+        self.assertEqual(len(self.profiles()), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,15 +7,19 @@ from api.v1.views import app_views
 from os import getenv
 from api.v1.auth.basic_auth import BasicAuth
 from api.v1.auth.session_auth import SessionAuth
+from api.v1.profiling import install_profiler
+from api.v1 import audit
 
 app = Flask(__name__)
 app.register_blueprint(app_views)
+install_profiler(app)
 
 auth = None
 if getenv("AUTH_TYPE") == "basic_auth":
     auth = BasicAuth()
 elif getenv("AUTH_TYPE") == "session_auth":
     auth = SessionAuth()
+audit.flush_on_sigterm()
 
 @app.before_request
 def before_request():
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Audit trail of authentication events.
+Events are queued in memory and written to SQLite in batches by a
+background thread, so recording one does not touch the disk.
+"""
+from collections import deque
+from os import getenv, getpid, kill
+import atexit
+import signal
+import sqlite3
+import threading
+import time
+
+
+class AuditLog:
+    """
+    Bounded in-memory queue of audit events drained into an append-only
+    SQLite table by a background writer thread.
+    """
+
+    def __init__(self, path: str, capacity: int = 10000,
+                 batch_size: int = 512, flush_interval: float = 0.5,
+                 block: bool = False):
+        """
+        Initializes the audit log; the writer starts on the first event.
+
+        Args:
+            path (str): Path of the SQLite database file.
+            capacity (int): Maximum number of queued events.
+            batch_size (int): Queued events that wake up the writer early.
+            flush_interval (float): Maximum seconds an event stays queued.
+            block (bool): When the queue is full, wait for room instead of
+                dropping the event.
+        """
+        self._path = path
+        self._capacity = capacity
+        self._batch_size = min(batch_size, capacity)
+        self._flush_interval = flush_interval
+        self._block = block
+        self._events = deque()
+        self._cond = threading.Condition()
+        self._writer = None
+        self._writer_done = False
+        self._closing = False
+        self._flush_requested = False
+        self._queued = 0
+        self._written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def record(self, event: str, email: str = None,
+               user_id: str = None) -> bool:
+        """
+        Queues an audit event.
+
+        Args:
+            event (str): Event name, such as "login" or "logout".
+            email (str, optional): Email of the user the event is about.
+            user_id (str, optional): ID of that user, when known.
+
+        Returns:
+            bool: True if the event was queued, False if it was dropped
+                because the queue was full, the log is closed or the
+                writer thread has stopped.
+        """
+        with self._cond:
+            if self._block:
+                self._cond.wait_for(
+                    lambda: self._closing or self._writer_done
+                    or len(self._events) < self._capacity)
+            if self._closing or self._writer_done or \
+                    len(self._events) >= self._capacity:
+                self.dropped += 1
+                return False
+            self._events.append((time.time(), event, email, user_id))
+            self._queued += 1
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run,
+                                                daemon=True)
+                self._writer.start()
+                atexit.register(self.close)
+            if len(self._events) >= self._batch_size:
+                self._cond.notify_all()
+        return True
+
+    def _connect(self):
+        """
+        Opens the database and creates the audit table if needed.
+
+        Returns:
+            sqlite3.Connection: The connection, or None if the database
+                cannot be opened.
+        """
+        conn = None
+        try:
+            conn = sqlite3.connect(self._path)
+            conn.execute("CREATE TABLE IF NOT EXISTS audit ("
+                         "ts REAL NOT NULL, event TEXT NOT NULL, "
+                         "email TEXT, user_id TEXT)")
+            conn.commit()
+            return conn
+        except sqlite3.Error:
+            if conn is not None:
+                conn.close()
+            return None
+
+    def _run(self):
+        """
+        Writer loop: drains queued events and inserts them in one
+        transaction per batch.
+
+        Events that cannot be written, including while the database
+        cannot be opened, are counted as failed and the queue keeps
+        draining; opening is retried on the next batch. Waiters are woken
+        when the thread stops, whatever the reason.
+        """
+        conn = None
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(
+                        lambda: self._closing or self._flush_requested
+                        or len(self._events) >= self._batch_size,
+                        timeout=self._flush_interval)
+                    batch = list(self._events)
+                    self._events.clear()
+                    self._flush_requested = False
+                    closing = self._closing
+                    self._cond.notify_all()
+                failed = 0
+                if batch:
+                    if conn is None:
+                        conn = self._connect()
+                    try:
+                        if conn is None:
+                            failed = len(batch)
+                        else:
+                            conn.executemany(
+                                "INSERT INTO audit VALUES (?, ?, ?, ?)",
+                                batch)
+                            conn.commit()
+                    except sqlite3.Error:
+                        failed = len(batch)
+                with self._cond:
+                    self.failed += failed
+                    self._written += len(batch)
+                    self._cond.notify_all()
+                if closing:
+                    break
+        finally:
+            if conn is not None:
+                conn.close()
+            with self._cond:
+                self._writer_done = True
+                self.dropped += len(self._events)
+                self._events.clear()
+                self._cond.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Waits until every event queued so far has been written.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait.
+
+        Returns:
+            bool: True if the queued events were handled in time, False
+                on timeout or if the writer thread stopped first.
+        """
+        with self._cond:
+            target = self._queued
+            self._flush_requested = True
+            self._cond.notify_all()
+            self._cond.wait_for(
+                lambda: self._written >= target or self._writer_done,
+                timeout=timeout)
+            return self._written >= target
+
+    def close(self):
+        """
+        Writes the remaining events and stops the writer thread.
+        """
+        with self._cond:
+            if self._closing:
+                return
+            self._closing = True
+            self._cond.notify_all()
+        if self._writer is not None:
+            self._writer.join()
+
+
+_audit_log = None
+_audit_log_lock = threading.Lock()
+
+
+def audit_log() -> AuditLog:
+    """
+    Returns the application audit log, configured by AUDIT_DB (default
+    "audit.db") and AUDIT_CAPACITY.
+    """
+    global _audit_log
+    if _audit_log is None:
+        with _audit_log_lock:
+            if _audit_log is None:
+                _audit_log = AuditLog(
+                    getenv("AUDIT_DB", "audit.db"),
+                    capacity=int(getenv("AUDIT_CAPACITY", 10000)))
+    return _audit_log
+
+
+def flush_on_sigterm(timeout: float = 5.0) -> None:
+    """
+    Installs a SIGTERM handler that writes the events queued on the
+    application audit log before the previous handler runs, since the
+    default action exits without running atexit. Must be called from the
+    main thread, at startup; elsewhere it does nothing.
+
+    Args:
+        timeout (float): Maximum seconds to wait for the events.
+    """
+    log = audit_log()
+
+    def handler(signum, frame):
+        log.flush(timeout)
+        if callable(previous):
+            previous(signum, frame)
+        elif previous != signal.SIG_IGN:
+            signal.signal(signum, signal.SIG_DFL)
+            kill(getpid(), signum)
+
+    previous = signal.getsignal(signal.SIGTERM)
+    try:
+        signal.signal(signal.SIGTERM, handler)
+    except ValueError:
+        pass
+
+
+def record(event: str, email: str = None, user_id: str = None) -> bool:
+    """
+    Queues an event on the application audit log.
+
+    Args:
+        event (str): Event name.
+        email (str, optional): Email of the user the event is about.
+        user_id (str, optional): ID of that user, when known.
+
+    Returns:
+        bool: True if the event was queued.
+    """
+    return audit_log().record(event, email, user_id)
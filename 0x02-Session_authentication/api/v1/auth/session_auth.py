@@ -3,15 +3,38 @@
 Session authentication module.
 """
 from api.v1.auth.auth import Auth
+from api.v1.auth.session_table import (SessionTable, restore_snapshots,
+                                       schedule_snapshots)
 import uuid
 from models.user import User
+from os import getenv
 
 class SessionAuth(Auth):
     """
     Session authentication class, inheriting from Auth.
     Manages session IDs mapped to user IDs.
     """
-    user_id_by_session_id = {}
+    user_id_by_session_id = SessionTable()
+    _snapshots = None
+
+    def __init__(self):
+        """
+        Restores the session table from the snapshots of every worker
+        under SESSION_SNAPSHOT_PATH when set, and snapshots it every
+        SESSION_SNAPSHOT_INTERVAL seconds (default 60), at exit and on
+        SIGTERM to SESSION_SNAPSHOT_PATH.<pid>, so sessions survive
+        restarts.
+        """
+        snapshot_path = getenv("SESSION_SNAPSHOT_PATH")
+        if not snapshot_path or SessionAuth._snapshots is not None:
+            return
+        try:
+            restore_snapshots(self.user_id_by_session_id, snapshot_path)
+        except OSError:
+            pass
+        interval = float(getenv("SESSION_SNAPSHOT_INTERVAL", 60))
+        SessionAuth._snapshots = schedule_snapshots(
+            self.user_id_by_session_id, snapshot_path, interval)
 
     def create_session(self, user_id: str = None) -> str:
         """
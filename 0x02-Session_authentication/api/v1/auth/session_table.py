@@ -0,0 +1,553 @@
+#!/usr/bin/env python3
+"""
+Compact in-memory session table.
+"""
+from array import array
+import atexit
+import glob
+import mmap
+import os
+import signal
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+_EMPTY = -1
+_DELETED = -2
+_MASK64 = (1 << 64) - 1
+
+# Snapshot file: header, then the high key, low key and value arrays in
+# native byte order, then the interned user IDs, each as its UTF-8 length
+# followed by its UTF-8 bytes
+_MAGIC = b'SESS'
+_VERSION = 2
+_HEADER = struct.Struct('<4sHBxQQQQQ')
+_ID_LENGTH = struct.Struct('<I')
+
+
+class SessionTable:
+    """
+    Open-addressing hash table mapping session IDs to user IDs.
+
+    Session IDs are stored as the two 64-bit halves of their UUID and
+    user IDs as indexes into a list of interned user ID strings, so a
+    session costs about 20 bytes per slot instead of two string objects
+    and a dict entry. Lookups take the usual string session IDs.
+
+    Writes are serialized by a lock. Lookups take no lock: a slot's key is
+    written before its value, and a resize swaps in new arrays at once.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        """
+        Initializes an empty table.
+
+        Args:
+            capacity (int): Initial number of slots, rounded up to a power of 2.
+        """
+        size = 8
+        while size < capacity:
+            size *= 2
+        self._lock = threading.Lock()
+        self._user_ids = []
+        self._user_index = {}
+        self._count = 0
+        self._used = 0
+        self._slots = self._new_slots(size)
+
+    @staticmethod
+    def _new_slots(size: int) -> tuple:
+        """
+        Allocates empty key and value arrays.
+
+        Args:
+            size (int): Number of slots.
+
+        Returns:
+            tuple: The high key halves, low key halves and user ID indexes.
+        """
+        return (array('Q', bytes(8 * size)), array('Q', bytes(8 * size)),
+                array('i', [_EMPTY]) * size)
+
+    @staticmethod
+    def _key(session_id: str) -> tuple:
+        """
+        Converts a session ID to the two halves of its 128-bit value.
+
+        Only the canonical lowercase layout produced by str(uuid4()) is
+        accepted, so a cookie matches exactly one session ID string.
+
+        Args:
+            session_id (str): The session ID, as found in the cookie.
+
+        Returns:
+            tuple: The high and low 64 bits, or None if not a canonical UUID.
+        """
+        if not isinstance(session_id, str) or len(session_id) != 36 or \
+                session_id[8] != '-' or session_id[13] != '-' or \
+                session_id[18] != '-' or session_id[23] != '-':
+            return None
+        hex_id = (session_id[:8] + session_id[9:13] + session_id[14:18] +
+                  session_id[19:23] + session_id[24:])
+        if hex_id != hex_id.lower():
+            return None
+        try:
+            raw = bytes.fromhex(hex_id)
+        except ValueError:
+            return None
+        # fromhex skips whitespace, which would leave fewer than 16 bytes
+        if len(raw) != 16:
+            return None
+        value = int.from_bytes(raw, 'big')
+        return value >> 64, value & _MASK64
+
+    @staticmethod
+    def _find(slots: tuple, hi: int, lo: int) -> int:
+        """
+        Finds the slot holding a key.
+
+        Args:
+            slots (tuple): The arrays to search.
+            hi (int): High 64 bits of the key.
+            lo (int): Low 64 bits of the key.
+
+        Returns:
+            int: The slot index, or -1 if the key is not present.
+        """
+        keys_hi, keys_lo, values = slots
+        mask = len(values) - 1
+        i = lo & mask
+        while True:
+            value = values[i]
+            if value == _EMPTY:
+                return -1
+            if value != _DELETED and keys_lo[i] == lo and keys_hi[i] == hi:
+                return i
+            i = (i + 1) & mask
+
+    def _place(self, slots: tuple, hi: int, lo: int, value: int) -> None:
+        """
+        Stores a key known to be absent in the first empty slot.
+
+        Args:
+            slots (tuple): The arrays to insert into.
+            hi (int): High 64 bits of the key.
+            lo (int): Low 64 bits of the key.
+            value (int): The user ID index.
+        """
+        keys_hi, keys_lo, values = slots
+        mask = len(values) - 1
+        i = lo & mask
+        while values[i] != _EMPTY:
+            i = (i + 1) & mask
+        keys_hi[i] = hi
+        keys_lo[i] = lo
+        values[i] = value
+
+    def _resize(self) -> None:
+        """
+        Rehashes live entries into arrays sized for at most 50% load,
+        dropping deleted slots.
+        """
+        keys_hi, keys_lo, values = self._slots
+        size = len(values)
+        while (self._count + 1) * 2 > size:
+            size *= 2
+        slots = self._new_slots(size)
+        for i, value in enumerate(values):
+            if value >= 0:
+                self._place(slots, keys_hi[i], keys_lo[i], value)
+        self._slots = slots
+        self._used = self._count
+
+    def _intern(self, user_id: str) -> int:
+        """
+        Returns the index of a user ID, adding it if new.
+
+        Args:
+            user_id (str): The user ID.
+
+        Returns:
+            int: Its index in the interned user ID list.
+        """
+        index = self._user_index.get(user_id)
+        if index is None:
+            index = len(self._user_ids)
+            self._user_ids.append(user_id)
+            self._user_index[user_id] = index
+        return index
+
+    def _insert(self, hi: int, lo: int, value: int) -> None:
+        """
+        Stores a key known to be absent, growing the table if needed; must
+        be called with the lock held.
+
+        Args:
+            hi (int): High 64 bits of the key.
+            lo (int): Low 64 bits of the key.
+            value (int): The user ID index.
+        """
+        if (self._used + 1) * 4 > len(self._slots[2]) * 3:
+            self._resize()
+        self._place(self._slots, hi, lo, value)
+        self._used += 1
+        self._count += 1
+
+    def __setitem__(self, session_id: str, user_id: str) -> None:
+        """
+        Maps a session ID to a user ID.
+
+        Args:
+            session_id (str): The session ID, in UUID format.
+            user_id (str): The user ID.
+
+        Raises:
+            ValueError: If the session ID is not a UUID.
+        """
+        key = self._key(session_id)
+        if key is None:
+            raise ValueError("session ID must be a UUID")
+        hi, lo = key
+        with self._lock:
+            value = self._intern(user_id)
+            i = self._find(self._slots, hi, lo)
+            if i >= 0:
+                self._slots[2][i] = value
+                return
+            self._insert(hi, lo, value)
+
+    def get(self, session_id: str, default: str = None) -> str:
+        """
+        Retrieves the user ID of a session ID.
+
+        Args:
+            session_id (str): The session ID.
+            default (str, optional): Returned when the session is unknown.
+
+        Returns:
+            str: The user ID, or default.
+        """
+        key = self._key(session_id)
+        if key is None:
+            return default
+        slots = self._slots
+        i = self._find(slots, *key)
+        if i < 0:
+            return default
+        value = slots[2][i]
+        if value < 0:
+            return default
+        return self._user_ids[value]
+
+    def __getitem__(self, session_id: str) -> str:
+        """
+        Retrieves the user ID of a session ID.
+
+        Raises:
+            KeyError: If the session is unknown.
+        """
+        user_id = self.get(session_id)
+        if user_id is None:
+            raise KeyError(session_id)
+        return user_id
+
+    def __contains__(self, session_id: str) -> bool:
+        """
+        Tells whether a session ID is in the table.
+        """
+        return self.get(session_id) is not None
+
+    def __delitem__(self, session_id: str) -> None:
+        """
+        Removes a session ID.
+
+        Raises:
+            KeyError: If the session is unknown.
+        """
+        key = self._key(session_id)
+        with self._lock:
+            i = -1 if key is None else self._find(self._slots, *key)
+            if i < 0:
+                raise KeyError(session_id)
+            self._slots[2][i] = _DELETED
+            self._count -= 1
+
+    def __len__(self) -> int:
+        """
+        Returns the number of sessions in the table.
+        """
+        return self._count
+
+    def dump(self, path: str) -> None:
+        """
+        Writes a snapshot of the table to a file, atomically.
+
+        The arrays are copied under the lock and written after releasing
+        it; the file is replaced only once the new one is on disk, and the
+        directory is synced so the rename survives a crash.
+
+        Args:
+            path (str): Path of the snapshot file.
+        """
+        with self._lock:
+            keys_hi, keys_lo, values = self._slots
+            user_ids = b''.join(
+                _ID_LENGTH.pack(len(encoded)) + encoded
+                for encoded in (user_id.encode('utf-8')
+                                for user_id in self._user_ids))
+            header = _HEADER.pack(_MAGIC, _VERSION, sys.byteorder == 'little',
+                                  len(values), self._count, self._used,
+                                  len(self._user_ids), len(user_ids))
+            parts = (header, keys_hi.tobytes(), keys_lo.tobytes(),
+                     values.tobytes(), user_ids)
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for part in parts:
+                    f.write(part)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        try:
+            dir_fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(dir_fd)
+        except OSError:
+            pass
+        finally:
+            os.close(dir_fd)
+
+    def load(self, path: str) -> None:
+        """
+        Replaces the contents of the table with a snapshot file.
+
+        The file is memory-mapped and its arrays copied in with one
+        memcpy each, without parsing individual sessions.
+
+        Args:
+            path (str): Path of the snapshot file.
+
+        Raises:
+            ValueError: If the file is not a valid snapshot for this machine,
+                or its slots do not match its counts.
+        """
+        with open(path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+                memoryview(mm) as view:
+            if len(view) < _HEADER.size:
+                raise ValueError("truncated session snapshot")
+            magic, version, little, size, count, used, ids_count, ids_len = \
+                _HEADER.unpack_from(view)
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError("not a session snapshot")
+            if little != (sys.byteorder == 'little'):
+                raise ValueError("session snapshot has another byte order")
+            slots = (array('Q'), array('Q'), array('i'))
+            offset = _HEADER.size
+            end = offset + size * sum(a.itemsize for a in slots) + ids_len
+            if size < 8 or size & (size - 1) or end != len(view):
+                raise ValueError("corrupted session snapshot")
+            for slot_array in slots:
+                length = size * slot_array.itemsize
+                slot_array.frombytes(view[offset:offset + length])
+                offset += length
+            user_ids = []
+            try:
+                for _ in range(ids_count):
+                    length, = _ID_LENGTH.unpack_from(view, offset)
+                    offset += _ID_LENGTH.size
+                    if offset + length > end:
+                        raise ValueError
+                    user_ids.append(str(view[offset:offset + length], 'utf-8'))
+                    offset += length
+            except (struct.error, ValueError):
+                raise ValueError("corrupted session snapshot") from None
+        values = slots[2]
+        empty = values.count(_EMPTY)
+        deleted = values.count(_DELETED)
+        # Lookups stop at an empty slot, so a table without one would
+        # make every miss loop forever
+        if offset != end or not empty or used != size - empty or \
+                count != used - deleted or \
+                min(values) < _DELETED or max(values) >= len(user_ids):
+            raise ValueError("corrupted session snapshot")
+        with self._lock:
+            self._slots = slots
+            self._user_ids = user_ids
+            self._user_index = {user_id: i
+                                for i, user_id in enumerate(user_ids)}
+            self._count = count
+            self._used = used
+
+    def merge(self, path: str) -> None:
+        """
+        Adds the sessions of a snapshot file to the table, keeping the
+        current user of a session present in both.
+
+        Args:
+            path (str): Path of the snapshot file.
+
+        Raises:
+            ValueError: If the file is not a valid snapshot.
+        """
+        other = SessionTable()
+        other.load(path)
+        keys_hi, keys_lo, values = other._slots
+        with self._lock:
+            for i, value in enumerate(values):
+                if value < 0:
+                    continue
+                hi, lo = keys_hi[i], keys_lo[i]
+                if self._find(self._slots, hi, lo) < 0:
+                    self._insert(hi, lo, self._intern(other._user_ids[value]))
+
+
+def _worker_path(path: str, pid: int = None) -> str:
+    """
+    Returns the snapshot file of a process: each worker of a server keeps
+    its own, so they do not overwrite each other's sessions.
+
+    Args:
+        path (str): Base path of the snapshot files.
+        pid (int, optional): Process ID, the current process if None.
+    """
+    return '{}.{}'.format(path, os.getpid() if pid is None else pid)
+
+
+def _running(pid: int) -> bool:
+    """
+    Tells whether a process exists.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def _dump_quietly(table: SessionTable, path: str) -> None:
+    """
+    Snapshots a table to the file of the current process, ignoring write
+    errors.
+    """
+    try:
+        table.dump(_worker_path(path))
+    except OSError:
+        pass
+
+
+def restore_snapshots(table: SessionTable, path: str) -> list:
+    """
+    Merges the snapshot of every worker into a table, so each worker of a
+    restarted server gets back all sessions, whichever worker created
+    them. Invalid or unreadable snapshots are skipped.
+
+    Snapshots of processes that no longer run are deleted once the
+    current process has written its own, which holds their sessions. A
+    snapshot deleted by another worker while this one lists them was
+    merged into that worker's own snapshot, so the listing is repeated.
+
+    Args:
+        table (SessionTable): The table to restore into.
+        path (str): Base path of the snapshot files.
+
+    Returns:
+        list: Paths of the merged snapshot files.
+    """
+    merged = {}
+    vanished = True
+    while vanished:
+        vanished = False
+        for snapshot in glob.glob(glob.escape(path) + '.*'):
+            pid = snapshot[len(path) + 1:]
+            if not pid.isdigit() or snapshot in merged:
+                continue
+            try:
+                table.merge(snapshot)
+            except FileNotFoundError:
+                vanished = True
+                continue
+            except (OSError, ValueError):
+                continue
+            merged[snapshot] = int(pid)
+    stale = [snapshot for snapshot, pid in merged.items()
+             if pid != os.getpid() and not _running(pid)]
+    if stale:
+        table.dump(_worker_path(path))
+        for snapshot in stale:
+            try:
+                os.unlink(snapshot)
+            except OSError:
+                pass
+    return list(merged)
+
+
+def _dump_on_sigterm(table: SessionTable, path: str,
+                     timeout: float = 5.0) -> None:
+    """
+    Installs a SIGTERM handler that snapshots a table before the previous
+    handler runs, since the default action exits without running atexit.
+
+    The snapshot is taken by a helper thread, waited for at most timeout
+    seconds: the signal may arrive while the main thread holds the table
+    lock. Does nothing outside the main thread, where signal handlers
+    cannot be installed.
+
+    Args:
+        table (SessionTable): The table to snapshot.
+        path (str): Base path of the snapshot files.
+        timeout (float): Maximum seconds to wait for the snapshot.
+    """
+    def handler(signum, frame):
+        writer = threading.Thread(target=_dump_quietly, args=(table, path),
+                                  daemon=True)
+        writer.start()
+        writer.join(timeout)
+        if callable(previous):
+            previous(signum, frame)
+        elif previous != signal.SIG_IGN:
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+    previous = signal.getsignal(signal.SIGTERM)
+    try:
+        signal.signal(signal.SIGTERM, handler)
+    except ValueError:
+        pass
+
+
+def schedule_snapshots(table: SessionTable, path: str,
+                       interval: float) -> threading.Thread:
+    """
+    Snapshots a table every interval seconds, at interpreter exit and on
+    SIGTERM, to the file of the current process: path followed by a dot
+    and the process ID.
+
+    Args:
+        table (SessionTable): The table to snapshot.
+        path (str): Base path of the snapshot files.
+        interval (float): Seconds between snapshots.
+
+    Returns:
+        threading.Thread: The daemon thread taking periodic snapshots.
+    """
+    def run():
+        while True:
+            time.sleep(interval)
+            _dump_quietly(table, path)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    atexit.register(_dump_quietly, table, path)
+    _dump_on_sigterm(table, path)
+    return thread
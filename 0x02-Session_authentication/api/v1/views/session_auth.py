@@ -3,11 +3,12 @@
 Session authentication routes for the API.
 """
 from flask import jsonify, request, abort
+from api.v1 import audit
 from api.v1.views import app_views
 from models.user import User
 from os import getenv
 
-@app_views.route('/auth_session/login', '/auth_session/login/', methods=['POST'], strict_slashes=False)
+@app_views.route('/auth_session/login', methods=['POST'], strict_slashes=False)
 def login():
     """
     Handles user login and creates a session.
@@ -28,19 +29,24 @@ def login():
 
     users = User.search({'email': email})
     if not users:
+        audit.record("login_failed", email)
         return jsonify({"error": "no user found for this email"}), 404
 
     user = users[0]  # Assume the first user if multiple are found
     if not user.is_valid_password(password):
+        audit.record("login_failed", email, user.id)
         return jsonify({"error": "wrong password"}), 401
 
     from api.v1.app import auth
     session_id = auth.create_session(user.id)
+    if session_id is not None:
+        audit.record("login", email, user.id)
+        audit.record("session_created", email, user.id)
     response = jsonify(user.to_json())
     response.set_cookie(getenv("SESSION_NAME"), session_id)
     return response
 
-@app_views.route('/auth_session/logout', '/auth_session/logout/', methods=['DELETE'], strict_slashes=False)
+@app_views.route('/auth_session/logout', methods=['DELETE'], strict_slashes=False)
 def logout():
     """
     Handles user logout by destroying the session.
@@ -51,6 +57,11 @@ def logout():
         JSON: Empty dictionary on success, or aborts with 404 if session deletion fails.
     """
     from api.v1.app import auth
+    user = getattr(request, 'current_user', None)
     if not auth.destroy_session(request):
         abort(404)
+    if user is None:
+        audit.record("logout")
+    else:
+        audit.record("logout", user.email, user.id)
     return jsonify({}), 200
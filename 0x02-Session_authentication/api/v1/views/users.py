@@ -6,6 +6,7 @@ from api.v1.views import app_views
 from flask import jsonify, request, abort
 from models.user import User
 from models import storage
+from os import getenv
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def get_users():
@@ -37,6 +38,38 @@ def create_user():
     user.save()
     return jsonify(user.to_dict()), 201
 
+@app_views.route('/users/batch', methods=['POST'], strict_slashes=False)
+def get_users_batch():
+    """
+    Retrieves several User objects in one request.
+
+    Expects a JSON body {"ids": [...]} with at most USERS_BATCH_MAX
+    (default 100) IDs. Each distinct ID is looked up once, within the one
+    authenticated request.
+
+    Returns:
+        JSON with the found users and the list of IDs that were not found.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        abort(400, description="Not a JSON")
+    ids = data.get('ids')
+    if not isinstance(ids, list) or \
+            not all(isinstance(user_id, str) for user_id in ids):
+        abort(400, description="ids must be a list of strings")
+    max_batch = int(getenv("USERS_BATCH_MAX", 100))
+    if len(ids) > max_batch:
+        abort(400, description="Too many ids, at most {}".format(max_batch))
+    users = []
+    missing = []
+    for user_id in dict.fromkeys(ids):
+        user = storage.get(User, user_id)
+        if user is None:
+            missing.append(user_id)
+        else:
+            users.append(user.to_dict())
+    return jsonify({"users": users, "missing": missing})
+
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
 def get_user(user_id):
     """
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Tests for the audit trail writer.
+Run from the project directory: python -m unittest discover tests
+"""
+import os
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.v1.audit import AuditLog  # noqa: E402
+
+
+class TestAuditLog(unittest.TestCase):
+    """
+    Events reach the database, and callers never hang on a broken writer.
+    """
+
+    def setUp(self):
+        """
+        Creates a directory for the audit database.
+        """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "audit.db")
+
+    def tearDown(self):
+        """
+        Removes the audit database.
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_events_written(self):
+        """
+        Flushed events are in the table, in order.
+        """
+        log = AuditLog(self.path, flush_interval=10)
+        for i in range(100):
+            self.assertTrue(log.record("login", "u%d@x" % i, str(i)))
+        self.assertTrue(log.flush(timeout=5))
+        log.close()
+        with sqlite3.connect(self.path) as conn:
+            rows = conn.execute(
+                "SELECT event, email, user_id FROM audit "
+                "ORDER BY rowid").fetchall()
+        self.assertEqual(rows, [("login", "u%d@x" % i, str(i))
+                                for i in range(100)])
+        self.assertEqual((log.dropped, log.failed), (0, 0))
+
+    def test_unopenable_database(self):
+        """
+        Events that cannot be written are counted as failed and flush
+        returns; the writer keeps draining the queue.
+        """
+        path = os.path.join(self.directory, "missing", "audit.db")
+        log = AuditLog(path, capacity=4, flush_interval=0.01)
+        for _ in range(3):
+            log.record("login", "user")
+            self.assertTrue(log.flush(timeout=5))
+        self.assertEqual(log.failed, 3)
+        os.mkdir(os.path.dirname(path))
+        log.record("login", "user")
+        self.assertTrue(log.flush(timeout=5))
+        log.close()
+        self.assertEqual(log.failed, 3)
+        with sqlite3.connect(path) as conn:
+            self.assertEqual(
+                conn.execute("SELECT COUNT(*) FROM audit").fetchone(), (1,))
+
+    def test_dead_writer_releases_waiters(self):
+        """
+        Blocked and flushing callers return once the writer has stopped.
+        """
+        log = AuditLog(self.path, capacity=2, flush_interval=10, block=True)
+        log._connect = lambda: 1 / 0
+        log.record("login", "user")
+        log.record("login", "user")
+        results = []
+        blocked = threading.Thread(
+            target=lambda: results.append(log.record("login", "user")))
+        blocked.start()
+        self.assertFalse(log.flush(timeout=5))
+        blocked.join(5)
+        self.assertFalse(blocked.is_alive())
+        self.assertEqual(results, [False])
+        self.assertFalse(log.record("login", "user"))
+        log.close()
+
+    def test_flush_on_sigterm(self):
+        """
+        Events still queued when SIGTERM arrives are written before the
+        process dies of the signal.
+        """
+        project = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        script = (
+            "import sys, time\n"
+            "from api.v1 import audit\n"
+            "audit._audit_log = audit.AuditLog(sys.argv[1], "
+            "flush_interval=3600)\n"
+            "audit.flush_on_sigterm()\n"
+            "for i in range(100):\n"
+            "    audit.record('login', 'u%d@x' % i, str(i))\n"
+            "print('ready', flush=True)\n"
+            "time.sleep(60)\n"
+        )
+        process = subprocess.Popen([sys.executable, "-c", script, self.path],
+                                   cwd=project, stdout=subprocess.PIPE,
+                                   text=True)
+        try:
+            self.assertEqual(process.stdout.readline(), "ready\n")
+            process.send_signal(signal.SIGTERM)
+            self.assertEqual(process.wait(10), -signal.SIGTERM)
+        finally:
+            process.kill()
+            process.stdout.close()
+        with sqlite3.connect(self.path) as conn:
+            self.assertEqual(
+                conn.execute("SELECT COUNT(*) FROM audit").fetchone(), (100,))
+
+
+if __name__ == "__main__":
+    unittest.main()
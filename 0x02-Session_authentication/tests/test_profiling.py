@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Regression tests for the per-request profiling hook.
+Run from the project directory: python -m unittest discover tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from flask import Flask, jsonify
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.v1.profiling import ProfilerMiddleware  # noqa: E402
+
+
+class TestProfilerMiddleware(unittest.TestCase):
+    """
+    Profiled requests get the same response as unprofiled ones, whatever
+    happens to the profile file.
+    """
+
+    def setUp(self):
+        """
+        Profile every request of a small app into a fresh directory.
+        """
+        self.app = Flask(__name__)
+
+        @self.app.route('/api/v1/<path:anything>')
+        def echo(anything):
+            return jsonify({"path": anything})
+
+        self.profile_dir = tempfile.mkdtemp()
+        self.app.wsgi_app = ProfilerMiddleware(
+            self.app.wsgi_app, self.profile_dir, sample_rate=1.0)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        """
+        Remove the profiles.
+        """
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+    def test_unsafe_paths(self):
+        """
+        Long paths and NUL bytes still give the view's response and a
+        short, safe file name.
+        """
+        for path in ('/api/v1/' + 'a' * 300, '/api/v1/%00x',
+                     '/api/v1/../x/..'):
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200, path)
+        names = os.listdir(self.profile_dir)
+        self.assertEqual(len(names), 3)
+        for name in names:
+            self.assertLess(len(name), 140)
+            self.assertRegex(name, r'^[0-9]+\.[0-9]+\.[A-Za-z0-9_.-]+\.prof$')
+
+    def test_unwritable_directory(self):
+        """
+        A missing profile directory loses the profile, not the response.
+        """
+        shutil.rmtree(self.profile_dir)
+        response = self.client.get('/api/v1/status')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {"path": "status"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Tests for the compact session table, checked against a reference dict.
+Run from the project directory: python -m unittest discover tests
+"""
+import os
+import random
+import signal
+import struct
+import subprocess
+import sys
+import tempfile
+import unittest
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.v1.auth.session_table import (  # noqa: E402
+    SessionTable, restore_snapshots)
+
+
+class TestSessionTable(unittest.TestCase):
+    """
+    SessionTable behaves like a dict keyed by session ID strings.
+    """
+
+    def assertSameAs(self, table: SessionTable, reference: dict,
+                     known: list):
+        """
+        Checks the table against the reference for every known session ID.
+        """
+        self.assertEqual(len(table), len(reference))
+        for session_id in known:
+            self.assertEqual(table.get(session_id),
+                             reference.get(session_id))
+            self.assertEqual(session_id in table, session_id in reference)
+
+    def test_matches_reference_dict(self):
+        """
+        Random inserts, overwrites and deletes across several resizes.
+        """
+        rng = random.Random(1234)
+        table = SessionTable(capacity=8)
+        reference = {}
+        known = []
+        users = [str(uuid.UUID(int=rng.getrandbits(128), version=4))
+                 for _ in range(50)]
+        sizes = set()
+        for step in range(20000):
+            action = rng.random()
+            if action < 0.6 or not reference:
+                session_id = str(uuid.UUID(int=rng.getrandbits(128),
+                                           version=4))
+                known.append(session_id)
+            else:
+                session_id = rng.choice(known)
+            if action < 0.8 or session_id not in reference:
+                user_id = rng.choice(users)
+                table[session_id] = user_id
+                reference[session_id] = user_id
+            else:
+                del table[session_id]
+                del reference[session_id]
+            sizes.add(len(table._slots[2]))
+            if step % 1000 == 0:
+                self.assertSameAs(table, reference, known)
+        self.assertSameAs(table, reference, known)
+        self.assertGreater(len(sizes), 5)
+        for session_id in known:
+            if session_id not in reference:
+                with self.assertRaises(KeyError):
+                    table[session_id]
+                with self.assertRaises(KeyError):
+                    del table[session_id]
+
+    def test_tombstones_are_reclaimed(self):
+        """
+        Churn without growth rehashes in place instead of growing.
+        """
+        table = SessionTable(capacity=64)
+        for _ in range(5000):
+            session_id = str(uuid.uuid4())
+            table[session_id] = "user"
+            del table[session_id]
+        self.assertEqual(len(table), 0)
+        self.assertEqual(len(table._slots[2]), 64)
+
+    def test_only_canonical_session_ids(self):
+        """
+        Only the exact str(uuid4()) form finds a session.
+        """
+        table = SessionTable()
+        session_id = str(uuid.uuid4())
+        table[session_id] = "user"
+        self.assertEqual(table.get(session_id), "user")
+        variants = [
+            session_id.upper(),
+            session_id.replace('-', ''),
+            session_id.replace('-', ' '),
+            '{' + session_id + '}',
+            'urn:uuid:' + session_id,
+            ' ' + session_id[1:],
+            session_id[:-2] + ' ' + session_id[-1],
+            None, 42, b'bytes', '',
+        ]
+        for variant in variants:
+            self.assertIsNone(table.get(variant), variant)
+            self.assertNotIn(variant, table)
+        with self.assertRaises(ValueError):
+            table[session_id.upper()] = "user"
+        with self.assertRaises(KeyError):
+            del table[session_id.replace('-', '')]
+        self.assertEqual(len(table), 1)
+
+    def test_snapshot_round_trip(self):
+        """
+        Any user ID string survives a dump and load, including empty ones
+        and ones containing NUL bytes.
+        """
+        user_ids = ["", "\0", "a\0b", "\0\0", "plain", "caf\u00e9"]
+        table = SessionTable(capacity=8)
+        reference = {}
+        for i in range(100):
+            session_id = str(uuid.uuid4())
+            table[session_id] = reference[session_id] = \
+                user_ids[i % len(user_ids)]
+        removed = list(reference)[:10]
+        for session_id in removed:
+            del table[session_id]
+            del reference[session_id]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "sessions.snap")
+            table.dump(path)
+            loaded = SessionTable()
+            loaded.load(path)
+            self.assertSameAs(loaded, reference, removed + list(reference))
+            with open(path, 'r+b') as f:
+                f.truncate(os.path.getsize(path) - 1)
+            with self.assertRaises(ValueError):
+                SessionTable().load(path)
+        empty = SessionTable()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "sessions.snap")
+            empty.dump(path)
+            loaded.load(path)
+        self.assertEqual(len(loaded), 0)
+        self.assertIsNone(loaded.get(removed[0]))
+
+    def test_snapshot_on_sigterm(self):
+        """
+        A process stopped by SIGTERM leaves a snapshot of its table in its
+        own file, and still dies of the signal.
+        """
+        project = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        script = (
+            "import sys, time\n"
+            "from api.v1.auth.session_table import SessionTable, "
+            "schedule_snapshots\n"
+            "table = SessionTable()\n"
+            "for session_id in sys.argv[2:]:\n"
+            "    table[session_id] = 'user-' + session_id\n"
+            "schedule_snapshots(table, sys.argv[1], 3600)\n"
+            "print('ready', flush=True)\n"
+            "time.sleep(60)\n"
+        )
+        session_ids = [str(uuid.uuid4()) for _ in range(50)]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "sessions.snap")
+            process = subprocess.Popen(
+                [sys.executable, "-c", script, path] + session_ids,
+                cwd=project, stdout=subprocess.PIPE, text=True)
+            try:
+                self.assertEqual(process.stdout.readline(), "ready\n")
+                process.send_signal(signal.SIGTERM)
+                self.assertEqual(process.wait(10), -signal.SIGTERM)
+            finally:
+                process.kill()
+                process.stdout.close()
+            self.assertEqual(os.listdir(directory),
+                             ["sessions.snap.{}".format(process.pid)])
+            loaded = SessionTable()
+            loaded.load("{}.{}".format(path, process.pid))
+        self.assertEqual(len(loaded), len(session_ids))
+        for session_id in session_ids:
+            self.assertEqual(loaded[session_id], 'user-' + session_id)
+
+    def test_inconsistent_snapshots(self):
+        """
+        Snapshots whose slots contradict their counts are rejected, in
+        particular one without an empty slot, where misses never end.
+        """
+        header = struct.Struct('<4sHBxQQQQQ')
+        table = SessionTable(capacity=8)
+        session_ids = [str(uuid.uuid4()) for _ in range(5)]
+        for session_id in session_ids:
+            table[session_id] = "user"
+        del table[session_ids[0]]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "sessions.snap")
+            table.dump(path)
+            with open(path, 'rb') as f:
+                data = f.read()
+            fields = header.unpack_from(data)
+            SessionTable().load(path)
+
+            def load_with(fields, values=None):
+                body = data[header.size:]
+                if values is not None:
+                    size = fields[3]
+                    body = body[:16 * size] + values.tobytes() + \
+                        body[20 * size:]
+                with open(path, 'wb') as f:
+                    f.write(header.pack(*fields) + body)
+                SessionTable().load(path)
+
+            size, count, used = fields[3:6]
+            for bad in ((count + 1, used), (count - 1, used),
+                        (count, used + 1), (count, used - 1)):
+                with self.assertRaises(ValueError):
+                    load_with(fields[:4] + bad + fields[6:])
+            full = table._slots[2][:]
+            for i, value in enumerate(full):
+                if value == -1:
+                    full[i] = -2
+            with self.assertRaises(ValueError):
+                load_with(fields[:4] + (count, size) + fields[6:], full)
+            bogus = table._slots[2][:]
+            bogus[bogus.index(-1)] = -3
+            with self.assertRaises(ValueError):
+                load_with(fields, bogus)
+            bogus = table._slots[2][:]
+            bogus[bogus.index(0)] = 1
+            with self.assertRaises(ValueError):
+                load_with(fields, bogus)
+
+    def test_restore_merges_workers(self):
+        """
+        Every worker's snapshot is merged; those of exited processes are
+        removed once the merged table is saved, others are kept.
+        """
+        dead = subprocess.Popen([sys.executable, "-c", ""])
+        dead.wait()
+        live = os.getppid()
+        reference = {}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "sessions.snap")
+            for pid in (dead.pid, live):
+                table = SessionTable()
+                for _ in range(300):
+                    session_id = str(uuid.uuid4())
+                    table[session_id] = reference[session_id] = \
+                        "user-{}".format(pid)
+                table.dump("{}.{}".format(path, pid))
+            with open(path + ".999999999", "wb") as f:
+                f.write(b"garbage")
+            SessionTable().dump(path + ".old")
+            restored = SessionTable()
+            merged = restore_snapshots(restored, path)
+            self.assertEqual(sorted(merged), sorted(
+                "{}.{}".format(path, pid) for pid in (dead.pid, live)))
+            self.assertSameAs(restored, reference, list(reference))
+            self.assertEqual(sorted(os.listdir(directory)), sorted(
+                "sessions.snap.{}".format(name) for name in
+                (live, os.getpid(), 999999999, "old")))
+            again = SessionTable()
+            restore_snapshots(again, path)
+            self.assertSameAs(again, reference, list(reference))
+
+
+if __name__ == "__main__":
+    unittest.main()
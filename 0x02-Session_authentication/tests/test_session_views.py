@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Tests for the audit events of the session login route, against stub
+models and authentication: the models package and the index views are
+not part of this project, so session_auth.py is loaded on its own.
+Run from the project directory: python -m unittest discover tests
+"""
+import importlib.util
+import os
+import sys
+import types
+import unittest
+from unittest import mock
+
+from flask import Blueprint, Flask
+
+PROJECT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT)
+
+
+class User:
+    """
+    Stub user model with the password "pw".
+    """
+
+    def __init__(self, user_id: str, email: str):
+        """
+        Initializes a user.
+        """
+        self.id = user_id
+        self.email = email
+
+    @classmethod
+    def search(cls, attributes: dict) -> list:
+        """
+        Finds the users with an email.
+        """
+        return [user for user in USERS if user.email == attributes['email']]
+
+    def is_valid_password(self, password: str) -> bool:
+        """
+        Checks a password.
+        """
+        return password == "pw"
+
+    def to_json(self) -> dict:
+        """
+        Returns the user as a dictionary.
+        """
+        return {"id": self.id, "email": self.email}
+
+
+USERS = [User("1", "a@x")]
+
+
+class TestLoginAudit(unittest.TestCase):
+    """
+    The login route records what actually happened.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Loads the session views with stub modules and serves them from a
+        bare app.
+        """
+        models = types.ModuleType("models")
+        models_user = types.ModuleType("models.user")
+        models_user.User = User
+        models.user = models_user
+        views = types.ModuleType("api.v1.views")
+        views.app_views = Blueprint('app_views', __name__,
+                                    url_prefix='/api/v1')
+        cls.app_module = types.ModuleType("api.v1.app")
+        cls._modules = mock.patch.dict(sys.modules, {
+            "models": models, "models.user": models_user,
+            "api.v1.views": views, "api.v1.app": cls.app_module})
+        cls._modules.start()
+        spec = importlib.util.spec_from_file_location(
+            "api.v1.views.session_auth",
+            os.path.join(PROJECT, "api", "v1", "views", "session_auth.py"))
+        cls.module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(cls.module)
+        app = Flask(__name__)
+        app.register_blueprint(views.app_views)
+        cls.client = app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Removes the stub modules.
+        """
+        cls._modules.stop()
+
+    def login(self, email: str, session_id: str = "sid") -> list:
+        """
+        Logs in with password "pw" and returns the recorded events.
+        """
+        self.app_module.auth = mock.Mock()
+        self.app_module.auth.create_session.return_value = session_id
+        with mock.patch.object(self.module.audit, "record") as record, \
+                mock.patch.dict(os.environ, {"SESSION_NAME": "sid"}):
+            self.client.post('/api/v1/auth_session/login',
+                             data={"email": email, "password": "pw"})
+        return [call.args for call in record.call_args_list]
+
+    def test_session_issued(self):
+        """
+        A login that issues a session records login and session_created.
+        """
+        self.assertEqual(self.login("a@x"), [
+            ("login", "a@x", "1"), ("session_created", "a@x", "1")])
+
+    def test_no_session(self):
+        """
+        Nothing is recorded when no session was issued.
+        """
+        self.assertEqual(self.login("a@x", None), [])
+
+    def test_unknown_email(self):
+        """
+        An unknown email is recorded as a failed login.
+        """
+        self.assertEqual(self.login("b@x"), [("login_failed", "b@x")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Tests for the POST /api/v1/users/batch endpoint, against a stub storage:
+the models package and the index views are not part of this project, so
+users.py is loaded on its own.
+Run from the project directory: python -m unittest discover tests
+"""
+import importlib.util
+import os
+import sys
+import types
+import unittest
+from unittest import mock
+
+from flask import Blueprint, Flask
+
+PROJECT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT)
+
+
+class User:
+    """
+    Stub user model.
+    """
+
+    def __init__(self, user_id: str):
+        """
+        Initializes a user with an ID.
+        """
+        self.id = user_id
+
+    def to_dict(self) -> dict:
+        """
+        Returns the user as a dictionary.
+        """
+        return {"id": self.id}
+
+
+class Storage:
+    """
+    Stub storage counting its lookups; scanning every user fails the test.
+    """
+
+    def __init__(self):
+        """
+        Initializes an empty storage.
+        """
+        self.objects = {}
+        self.gets = []
+
+    def get(self, cls, user_id):
+        """
+        Returns the user with this ID, or None.
+        """
+        self.gets.append(user_id)
+        return self.objects.get(user_id)
+
+    def all(self, cls=None):
+        """
+        Not used by the batch endpoint.
+        """
+        raise AssertionError("the batch endpoint must not scan storage")
+
+
+class TestUsersBatch(unittest.TestCase):
+    """
+    POST /api/v1/users/batch looks up each requested ID once.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Loads the user views with stub models and serves them from a bare
+        app.
+        """
+        cls.storage = Storage()
+        models = types.ModuleType("models")
+        models.storage = cls.storage
+        models_user = types.ModuleType("models.user")
+        models_user.User = User
+        models.user = models_user
+        views = types.ModuleType("api.v1.views")
+        views.app_views = Blueprint('app_views', __name__,
+                                    url_prefix='/api/v1')
+        cls._modules = mock.patch.dict(sys.modules, {
+            "models": models, "models.user": models_user,
+            "api.v1.views": views})
+        cls._modules.start()
+        spec = importlib.util.spec_from_file_location(
+            "api.v1.views.users",
+            os.path.join(PROJECT, "api", "v1", "views", "users.py"))
+        spec.loader.exec_module(importlib.util.module_from_spec(spec))
+        app = Flask(__name__)
+        app.register_blueprint(views.app_views)
+        cls.client = app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Removes the stub modules.
+        """
+        cls._modules.stop()
+
+    def setUp(self):
+        """
+        Stores three users.
+        """
+        self.storage.objects = {user_id: User(user_id)
+                                for user_id in ("a", "b", "c")}
+        self.storage.gets = []
+
+    def post(self, body):
+        """
+        Posts a JSON body to the endpoint.
+        """
+        return self.client.post('/api/v1/users/batch', json=body)
+
+    def test_found_and_missing(self):
+        """
+        Users come back in request order, duplicates once, with the
+        unknown IDs listed as missing.
+        """
+        response = self.post({"ids": ["c", "x", "a", "c", "y", "x"]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {
+            "users": [{"id": "c"}, {"id": "a"}],
+            "missing": ["x", "y"]})
+        self.assertEqual(self.storage.gets, ["c", "x", "a", "y"])
+
+    def test_empty_list(self):
+        """
+        No IDs give empty lists without touching storage.
+        """
+        response = self.post({"ids": []})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {"users": [], "missing": []})
+        self.assertEqual(self.storage.gets, [])
+
+    def test_bad_requests(self):
+        """
+        Malformed bodies and oversized batches are rejected with 400.
+        """
+        for body in (None, [], "ids", {}, {"ids": "a"}, {"ids": [1]},
+                     {"ids": ["a", None]}, {"ids": {"a": 1}}):
+            response = self.post(body)
+            self.assertEqual(response.status_code, 400, body)
+        response = self.client.post('/api/v1/users/batch', data="not json",
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.storage.gets, [])
+
+    def test_batch_limit(self):
+        """
+        USERS_BATCH_MAX bounds the number of IDs, duplicates included.
+        """
+        with mock.patch.dict(os.environ, {"USERS_BATCH_MAX": "3"}):
+            self.assertEqual(self.post({"ids": ["a"] * 3}).status_code, 200)
+            self.assertEqual(self.post({"ids": ["a"] * 4}).status_code, 400)
+        ids = ["u{}".format(i) for i in range(101)]
+        self.assertEqual(self.post({"ids": ids[:100]}).status_code, 200)
+        self.assertEqual(self.post({"ids": ids}).status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
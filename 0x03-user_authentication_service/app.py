@@ -5,9 +5,13 @@ This module sets up a Flask application with user registration endpoint.
 """
 from flask import Flask, jsonify, request
 from auth import Auth
+from profiling import install_profiler
+import audit
 
 app = Flask(__name__)
+install_profiler(app)
 AUTH = Auth()
+audit.flush_on_sigterm()
 
 @app.route('/', methods=['GET'], strict_slashes=False)
 def welcome() -> str:
@@ -3,16 +3,17 @@
 Authentication module
 This module provides authentication-related utilities and the Auth class.
 """
+import audit
 from db import DB
 from user import User
 from sqlalchemy.orm.exc import NoResultFound
-import bcrypt
+import hashers
 import uuid
 
 def _hash_password(password: str) -> bytes:
-    """Hash a password using bcrypt with salt"""
-    password_bytes = password.encode('utf-8')
-    return bcrypt.hashpw(password_bytes, bcrypt.gensalt())
+    """Hash a password with salt using the default hasher (bcrypt unless
+    PASSWORD_HASHER says otherwise)"""
+    return hashers.hash_password(password)
 
 def _generate_uuid() -> str:
     """Generate a new UUID and return its string representation"""
@@ -20,8 +21,8 @@ def _generate_uuid() -> str:
 
 class Auth:
     """Auth class to interact with the authentication database."""
-    def __init__(self):
-        self._db = DB()
+    def __init__(self, **db_options):
+        self._db = DB(**db_options)
 
     def register_user(self, email: str, password: str) -> User:
         """Register a new user"""
@@ -37,11 +38,12 @@ class Auth:
         try:
             user = self._db.find_user_by(email=email)
         except NoResultFound:
+            audit.record("login_failed", email)
             return False
         
-        password_bytes = password.encode('utf-8')
-        hashed_password = user.hashed_password.encode('utf-8')
-        return bcrypt.checkpw(password_bytes, hashed_password)
+        valid = hashers.verify_password(password, user.hashed_password)
+        audit.record("login" if valid else "login_failed", email, user.id)
+        return valid
 
     def create_session(self, email: str) -> str:
         """Create a new session for a user
@@ -59,4 +61,5 @@ class Auth:
         
         session_id = _generate_uuid()
         self._db.update_user(user.id, session_id=session_id)
+        audit.record("session_created", email, user.id)
         return session_id
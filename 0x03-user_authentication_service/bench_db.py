@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+DB benchmark
+Runs concurrent registrations followed by logins (email lookup plus
+session update, without password hashing) against DB, and reports
+throughput, commits per second and login latency percentiles. Then
+compares single-thread email lookups through find_user_by, which uses
+cached compiled statements, with plain filter_by queries.
+
+Usage: ./bench_db.py [--dir DIR] [--threads N] [--users N] [--shards N ...]
+                     [--lookup-users N] [--lookups N]
+The database files are created in DIR, which should be on the disk the
+service uses: a tmpfs hides the fsync cost being measured.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from db import DB
+from user import User
+
+
+def run(threads: int, users: int, **db_options) -> dict:
+    """Benchmark one DB configuration in the current directory
+
+    Args:
+        threads: Number of concurrent client threads
+        users: Number of users each thread registers and logs in
+        db_options: Keyword arguments for DB
+
+    Returns:
+        Measured throughput and latencies
+    """
+    db = DB(threaded=True, **db_options)
+    latencies = [[] for _ in range(threads)]
+    barrier = threading.Barrier(threads + 1)
+
+    def client(i: int) -> None:
+        emails = [f"user{i}_{j}@bench" for j in range(users)]
+        barrier.wait()
+        for email in emails:
+            db.add_user(email, "hashed")
+        for j, email in enumerate(emails):
+            start = time.perf_counter()
+            user = db.find_user_by(email=email)
+            db.update_user(user.id, session_id=f"session{i}_{j}")
+            latencies[i].append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=client, args=(i,))
+               for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    db.close()
+    logins = sorted(lat for thread in latencies for lat in thread)
+    return {
+        "ops_per_sec": 2 * len(logins) / elapsed,
+        "commits_per_sec": db.commits / elapsed,
+        "login_p50_ms": logins[len(logins) // 2] * 1000,
+        "login_p99_ms": logins[int(len(logins) * 0.99)] * 1000,
+    }
+
+
+def run_lookups(users: int, lookups: int) -> dict:
+    """Benchmark email lookups in the current directory
+
+    Args:
+        users: Number of users in the table
+        lookups: Number of lookups per method
+
+    Returns:
+        Lookups per second through find_user_by and through filter_by
+    """
+    db = DB()
+    emails = [f"user{i}@bench" for i in range(users)]
+    for email in emails:
+        db.add_user(email, "hashed")
+    session = db._session
+
+    def find_user_by(email: str) -> User:
+        return db.find_user_by(email=email)
+
+    def filter_by(email: str) -> User:
+        return session.query(User).filter_by(email=email).one()
+
+    result = {}
+    for name, lookup in (("find_user_by", find_user_by),
+                         ("filter_by", filter_by)):
+        start = time.perf_counter()
+        for i in range(lookups):
+            lookup(emails[i % users])
+        result[name] = lookups / (time.perf_counter() - start)
+    db.close()
+    return result
+
+
+def report(label: str, result: dict) -> None:
+    """Print one benchmark result"""
+    print("{:<32} {:>9.0f} ops/s {:>9.0f} commits/s "
+          "login p50 {:>7.2f} ms  p99 {:>7.2f} ms".format(
+              label, result["ops_per_sec"], result["commits_per_sec"],
+              result["login_p50_ms"], result["login_p99_ms"]))
+
+
+def main() -> None:
+    """Parse arguments and run the benchmarks"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--dir", default=".",
+                        help="directory on the disk under test")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--users", type=int, default=50,
+                        help="users registered and logged in per thread")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="shard counts to compare")
+    parser.add_argument("--lookup-users", type=int, default=100,
+                        help="users in the table for the lookup benchmark")
+    parser.add_argument("--lookups", type=int, default=20000,
+                        help="lookups per method")
+    args = parser.parse_args()
+
+    print(f"{args.threads} threads x {args.users} users")
+    with tempfile.TemporaryDirectory(dir=args.dir) as workdir:
+        os.chdir(workdir)
+        for group_commit in (False, True):
+            for shards in args.shards:
+                label = "{} shard{}, group commit {}".format(
+                    shards, "s" if shards > 1 else "",
+                    "on" if group_commit else "off")
+                report(label, run(args.threads, args.users, shards=shards,
+                                  group_commit=group_commit))
+        lookups = run_lookups(args.lookup_users, args.lookups)
+        print("{} users, email lookups: find_user_by {:.0f}/s, "
+              "filter_by {:.0f}/s".format(args.lookup_users,
+                                          lookups["find_user_by"],
+                                          lookups["filter_by"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Password hasher benchmark
+Reports single-thread hashes per second and the peak memory one hash
+adds to the process, for bcrypt and scrypt at several cost settings.
+Each setting runs in its own child process, so peak memory is not
+inherited from a previous, more expensive one.
+
+Usage: ./bench_hashers.py [--seconds S]
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from hashers import BcryptHasher, ScryptHasher
+
+SETTINGS = [
+    ("bcrypt, rounds=10", lambda: BcryptHasher(rounds=10)),
+    ("bcrypt, rounds=12", lambda: BcryptHasher(rounds=12)),
+    ("scrypt, n=2^12, r=8", lambda: ScryptHasher(n=2 ** 12, r=8)),
+    ("scrypt, n=2^14, r=8", lambda: ScryptHasher(n=2 ** 14, r=8)),
+    ("scrypt, n=2^15, r=8", lambda: ScryptHasher(n=2 ** 15, r=8)),
+]
+
+
+def peak_rss_kib() -> float:
+    """Peak resident set size of this process in KiB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / 1024 if sys.platform == "darwin" else peak
+
+
+def measure(index: int, seconds: float) -> dict:
+    """Benchmark one setting in the current process
+
+    Args:
+        index: Position of the setting in SETTINGS
+        seconds: Minimum time spent hashing
+
+    Returns:
+        Hashes per second and the peak memory added by hashing
+    """
+    hasher = SETTINGS[index][1]()
+    baseline = peak_rss_kib()
+    hashes = 0
+    start = time.perf_counter()
+    while True:
+        hasher.hash(b"correct horse battery staple")
+        hashes += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds and hashes >= 3:
+            break
+    return {
+        "hashes_per_sec": hashes / elapsed,
+        "peak_kib": peak_rss_kib() - baseline,
+    }
+
+
+def main() -> None:
+    """Parse arguments and run each setting in a child process"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--seconds", type=float, default=2.0,
+                        help="minimum time spent on each setting")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(measure(args.child, args.seconds)))
+        return
+    for index, (label, _) in enumerate(SETTINGS):
+        output = subprocess.run(
+            [sys.executable, __file__, "--child", str(index),
+             "--seconds", str(args.seconds)],
+            check=True, stdout=subprocess.PIPE).stdout
+        result = json.loads(output)
+        print("{:<24} {:>8.1f} hashes/s  peak +{:>8.0f} KiB".format(
+            label, result["hashes_per_sec"], result["peak_kib"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,71 +3,425 @@
 DB module for database operations
 This module provides a DB class to handle database operations.
 """
-from sqlalchemy import create_engine
+import contextlib
+import hashlib
+import itertools
+import threading
+import zlib
+
+from sqlalchemy import bindparam, create_engine, event, inspect
 from sqlalchemy.exc import InvalidRequestError
-from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
+from sqlalchemy.ext import baked
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.session import Session
 
 from user import Base, User
 
-class DB:
-    """DB class for database operations
+
+class _Batch:
+    """A group of writes that become durable in the same commit
     """
 
     def __init__(self) -> None:
-        """Initialize a new DB instance
+        """Initialize an empty batch
+        """
+        self.size = 0
+        self.error = None
+        self.done = threading.Event()
+
+
+class _EmailFilter:
+    """Bloom filter of every email stored in the users table
+
+    A negative answer is exact, a positive one may be a false positive.
+    """
+
+    def __init__(self, size_bits: int, hashes: int = 7) -> None:
+        """Initialize an empty filter
+
+        Args:
+            size_bits: Number of bits in the filter
+            hashes: Number of bit positions set per email
+        """
+        self._size = size_bits
+        self._hashes = hashes
+        self._bits = bytearray((size_bits + 7) // 8)
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _positions(self, email: str):
+        """Bit positions of an email, by double hashing one digest
+        """
+        digest = hashlib.blake2b(email.encode('utf-8'),
+                                 digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self._hashes):
+            yield (h1 + i * h2) % self._size
+
+    def add(self, email: str) -> None:
+        """Record an email as present
+        """
+        with self._lock:
+            for pos in self._positions(email):
+                self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, email: str) -> bool:
+        """Whether the email may be present
+        """
+        return all(self._bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(email))
+
+    def rejects(self, email: str) -> bool:
+        """Whether the email is certainly absent, counting such answers
         """
-        self._engine = create_engine("sqlite:///a.db", echo=False)
+        if email in self:
+            return False
+        with self._lock:
+            self.rejected += 1
+        return True
+
+
+class _Shard:
+    """One SQLite database file holding part of the users table
+    """
+
+    def __init__(self, url: str, index: int, count: int,
+                 threaded: bool, group_commit: bool,
+                 commit_interval_ms: int, commit_batch_size: int) -> None:
+        """Initialize a shard and recreate its users table
+
+        Args:
+            url: Database URL of the shard
+            index: Position of the shard, from 0
+            count: Total number of shards
+            threaded: Whether the session is shared between threads
+            group_commit: Commit queued writes in batches
+            commit_interval_ms: Maximum wait of a queued write
+            commit_batch_size: Queued writes that trigger a commit
+        """
+        # When threaded, access to the session is serialized by self.lock
+        self._engine = create_engine(
+            url, echo=False,
+            connect_args={"check_same_thread": not threaded})
+        if group_commit:
+            # Each write runs in a SAVEPOINT. pysqlite only emits BEGIN
+            # before DML, so a leading SAVEPOINT would open the transaction
+            # and its RELEASE would commit it: let SQLAlchemy emit BEGIN
+            event.listen(self._engine, "connect", self._no_implicit_begin)
+            event.listen(self._engine, "begin",
+                         lambda conn: conn.execute("BEGIN"))
         Base.metadata.drop_all(self._engine)
         Base.metadata.create_all(self._engine)
         self.__session = None
+        self._threaded = threaded
+        self.lock = threading.RLock()
+        # Shard i hands out ids i + 1, i + 1 + count, ... so ids are
+        # unique across shards and (id - 1) % count gives the shard back
+        self._ids = itertools.count(index + 1, count)
+        self.commits = 0
+        self.group_commit = group_commit
+        self._closed = False
+        if group_commit:
+            self._commit_interval = commit_interval_ms / 1000
+            self._commit_batch_size = commit_batch_size
+            self._batch = _Batch()
+            self._flush_now = threading.Event()
+            self._flusher = threading.Thread(target=self._flush_loop,
+                                             daemon=True)
+            self._flusher.start()
 
     @property
-    def _session(self) -> Session:
+    def session(self) -> Session:
         """Memoized session object
         """
         if self.__session is None:
-            DBSession = sessionmaker(bind=self._engine)
+            # Objects are read back by their caller outside the lock (and
+            # after the flusher thread committed them), so keep them loaded
+            DBSession = sessionmaker(bind=self._engine,
+                                     expire_on_commit=not self._threaded)
             self.__session = DBSession()
         return self.__session
 
+    @staticmethod
+    def _no_implicit_begin(dbapi_connection, connection_record) -> None:
+        """Stop pysqlite from opening transactions on its own
+        """
+        dbapi_connection.isolation_level = None
+
+    def next_id(self) -> int:
+        """Allocate a user id; must be called with the lock held
+        """
+        return next(self._ids)
+
+    @contextlib.contextmanager
+    def write(self):
+        """Hold the lock while the block changes the session, then make
+        the changes durable
+
+        Without group commit, the changes are committed on exit or rolled
+        back if the block raises. With group commit, they are made in a
+        SAVEPOINT and flushed before the lock is released, so a failing
+        write is rolled back alone and raises only in its caller, and no
+        pending change is left for another thread's query to autoflush.
+        The caller then joins the current batch and blocks until the
+        flusher thread has committed it; if that commit fails, every
+        caller of the batch receives the error.
+
+        Once the shard is closed, writes are committed directly.
+        """
+        with self.lock:
+            if not self.group_commit or self._closed:
+                try:
+                    yield
+                    self.session.commit()
+                except Exception:
+                    self.session.rollback()
+                    raise
+                self.commits += 1
+                return
+            savepoint = self.session.begin_nested()
+            try:
+                yield
+                savepoint.commit()
+            except Exception:
+                savepoint.rollback()
+                self._reload_expired()
+                raise
+            self._join_batch()
+
+    def _reload_expired(self) -> None:
+        """Reload the objects a rolled back SAVEPOINT expired, so their
+        callers never lazy-load them outside the lock
+        """
+        for obj in list(self.session.identity_map.values()):
+            if inspect(obj).expired_attributes:
+                self.session.refresh(obj)
+
+    def _join_batch(self) -> None:
+        """Wait until the current batch is committed; must be called
+        with the lock held, which is released while waiting
+        """
+        batch = self._batch
+        batch.size += 1
+        if batch.size >= self._commit_batch_size:
+            self._flush_now.set()
+        self.lock.release()
+        try:
+            batch.done.wait()
+        finally:
+            self.lock.acquire()
+        if batch.error is not None:
+            raise batch.error
+
+    def _flush(self) -> None:
+        """Commit the current batch and wake up its callers
+        """
+        with self.lock:
+            batch = self._batch
+            if batch.size == 0:
+                return
+            self._batch = _Batch()
+            try:
+                self.session.commit()
+                self.commits += 1
+            except Exception as e:
+                self.session.rollback()
+                batch.error = e
+        batch.done.set()
+
+    def _flush_loop(self) -> None:
+        """Commit queued writes every commit interval or batch size
+        """
+        while not self._closed:
+            self._flush_now.wait(self._commit_interval)
+            self._flush_now.clear()
+            self._flush()
+
+    def close(self) -> None:
+        """Commit any queued writes and stop the flusher thread
+        """
+        if self.group_commit and not self._closed:
+            self._closed = True
+            self._flush_now.set()
+            self._flusher.join()
+            self._flush()
+
+
+class DB:
+    """DB class for database operations
+    """
+
+    def __init__(self, group_commit: bool = False,
+                 commit_interval_ms: int = 5,
+                 commit_batch_size: int = 64,
+                 email_filter_bits: int = 1 << 23,
+                 shards: int = 1,
+                 threaded: bool = False) -> None:
+        """Initialize a new DB instance
+
+        Args:
+            group_commit: Queue writes from concurrent callers and commit
+                them together in a single transaction
+            commit_interval_ms: Maximum time a queued write waits before
+                its batch is committed (group commit only)
+            commit_batch_size: Number of queued writes that triggers an
+                immediate commit (group commit only)
+            email_filter_bits: Size of the Bloom filter used to answer
+                lookups of unknown emails without a query, 0 to disable
+            shards: Number of SQLite files users are partitioned across
+                by a hash of their email; each has its own writer lock
+            threaded: Allow the instance to be used from several threads;
+                implied by group_commit and by more than one shard
+        """
+        if shards < 1:
+            raise ValueError("shards must be at least 1")
+        if shards == 1:
+            urls = ["sqlite:///a.db"]
+        else:
+            urls = [f"sqlite:///a_{i}.db" for i in range(shards)]
+        threaded = threaded or group_commit or shards > 1
+        self._shards = [
+            _Shard(url, i, shards, threaded, group_commit,
+                   commit_interval_ms, commit_batch_size)
+            for i, url in enumerate(urls)
+        ]
+        # The tables are recreated empty above, so the filter starts complete
+        self._email_filter = None
+        if email_filter_bits:
+            self._email_filter = _EmailFilter(email_filter_bits)
+        self._bakery = baked.bakery()
+        self._lookups = {}
+
+    @property
+    def _session(self) -> Session:
+        """Memoized session object of the first shard
+        """
+        return self._shards[0].session
+
+    @property
+    def queries_avoided(self) -> int:
+        """Number of lookups the email filter answered without a query
+        """
+        if self._email_filter is None:
+            return 0
+        return self._email_filter.rejected
+
+    @property
+    def commits(self) -> int:
+        """Number of transactions committed across all shards
+        """
+        return sum(shard.commits for shard in self._shards)
+
+    def _shard_for_email(self, email: str) -> _Shard:
+        """Shard holding the user with this email
+        """
+        crc = zlib.crc32(email.encode('utf-8'))
+        return self._shards[crc % len(self._shards)]
+
+    def _shard_for_id(self, user_id: int) -> _Shard:
+        """Shard holding the user with this id
+        """
+        return self._shards[(user_id - 1) % len(self._shards)]
+
+    def _lookup(self, session: Session, kwargs: dict, limit: int = None):
+        """Query of the users matching kwargs
+
+        Lookups on the same set of columns share one baked query, so the
+        statement is constructed and compiled only the first time.
+
+        Raises:
+            InvalidRequestError: When a keyword is not a user column
+        """
+        if any(value is None for value in kwargs.values()):
+            # filter_by renders these as IS NULL, which a bound parameter
+            # cannot express
+            query = session.query(User).filter_by(**kwargs)
+            return query if limit is None else query.limit(limit)
+        keys = tuple(sorted(kwargs))
+        lookup = self._lookups.get((keys, limit))
+        if lookup is None:
+            for key in keys:
+                if key not in User.__table__.columns:
+                    raise InvalidRequestError(f"Invalid column: {key}")
+            lookup = self._bakery(lambda session: session.query(User))
+            # The baked cache is keyed on the code of each criteria
+            # function, so the columns and limit are added to the key
+            lookup.add_criteria(lambda query: query.filter(
+                *[getattr(User, key) == bindparam(key) for key in keys]),
+                keys)
+            if limit is not None:
+                lookup.add_criteria(lambda query: query.limit(limit), limit)
+            self._lookups[(keys, limit)] = lookup
+        return lookup(session).params(**kwargs)
+
+    def close(self) -> None:
+        """Commit any queued writes and stop the flusher threads
+        """
+        for shard in self._shards:
+            shard.close()
+
     def add_user(self, email: str, hashed_password: str) -> User:
         """Add a new user to the database
-        
+
         Args:
             email: User's email address
             hashed_password: Hashed password for the user
-            
+
         Returns:
             The created User object
         """
-        try:
-            new_user = User(email=email, hashed_password=hashed_password)
-            self._session.add(new_user)
-            self._session.commit()
-        except Exception as e:
-            self._session.rollback()
-            raise e
+        shard = self._shard_for_email(email)
+        with shard.write():
+            if self._email_filter is not None:
+                self._email_filter.add(email)
+            new_user = User(id=shard.next_id(), email=email,
+                            hashed_password=hashed_password)
+            shard.session.add(new_user)
         return new_user
 
     def find_user_by(self, **kwargs) -> User:
         """Find a user by arbitrary keyword arguments
-        
+
+        The query goes to a single shard when an email or id is given,
+        and to every shard otherwise.
+
         Args:
             kwargs: Arbitrary keyword arguments to filter users
-            
+
         Returns:
             The first found User object matching the criteria
-            
+
         Raises:
             NoResultFound: When no user is found
             InvalidRequestError: When wrong query arguments are passed
         """
+        if (self._email_filter is not None and 'email' in kwargs
+                and isinstance(kwargs['email'], str)
+                and all(key in User.__table__.columns for key in kwargs)
+                and self._email_filter.rejects(kwargs['email'])):
+            raise NoResultFound("No user found with these criteria")
+        if isinstance(kwargs.get('email'), str):
+            shards = [self._shard_for_email(kwargs['email'])]
+        elif isinstance(kwargs.get('id'), int):
+            shards = [self._shard_for_id(kwargs['id'])]
+        else:
+            shards = self._shards
         try:
-            user = self._session.query(User).filter_by(**kwargs).one()
-            return user
+            if len(shards) == 1:
+                with shards[0].lock:
+                    return self._lookup(shards[0].session, kwargs).one()
+            users = []
+            for shard in shards:
+                with shard.lock:
+                    users.extend(self._lookup(shard.session, kwargs, 2))
+            if len(users) > 1:
+                raise MultipleResultsFound("Multiple rows were found")
+            if not users:
+                raise NoResultFound("No row was found")
+            return users[0]
         except NoResultFound:
             raise NoResultFound("No user found with these criteria")
         except InvalidRequestError as e:
@@ -75,32 +429,38 @@ class DB:
 
     def update_user(self, user_id: int, **kwargs) -> None:
         """Update a user's attributes
-        
+
         Args:
             user_id: ID of the user to update
             kwargs: Arbitrary keyword arguments of user attributes to update
-            
+
         Raises:
-            ValueError: If an argument doesn't correspond to a user attribute
+            ValueError: If an argument doesn't correspond to a user attribute,
+                or if a new email would move the user to another shard
         """
         # List of valid user attributes
         valid_attributes = ['email', 'hashed_password', 'session_id', 'reset_token']
-        
+
         # Check if all kwargs keys are valid attributes
         for key in kwargs:
             if key not in valid_attributes:
                 raise ValueError(f"Invalid attribute: {key}")
-        
+
         try:
-            # Find the user by ID
             user = self.find_user_by(id=user_id)
-            
-            # Update user attributes
-            for key, value in kwargs.items():
-                setattr(user, key, value)
-            
-            # Commit changes to database
-            self._session.commit()
+            shard = self._shard_for_id(user.id)
+            if (isinstance(kwargs.get('email'), str)
+                    and self._shard_for_email(kwargs['email']) is not shard):
+                raise ValueError("New email belongs to another shard")
+
+            with shard.write():
+                if (self._email_filter is not None
+                        and isinstance(kwargs.get('email'), str)):
+                    self._email_filter.add(kwargs['email'])
+
+                # Update user attributes
+                for key, value in kwargs.items():
+                    setattr(user, key, value)
         except (NoResultFound, InvalidRequestError) as e:
             # Re-raise the exception since we're not handling it here
             raise e
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Profiling module
+On-demand per-request profiling for the Flask app.
+Profiles single requests, selected by a privileged header or at random,
+and writes the result as pstats files.
+"""
+
+import cProfile
+import glob
+import hashlib
+import hmac
+import os
+import random
+import re
+import threading
+import time
+
+_UNSAFE = re.compile(r'[^A-Za-z0-9_-]+')
+
+
+class ProfilerMiddleware:
+    """
+    WSGI middleware running selected requests under cProfile.
+    The whole request is profiled, including before_request handlers.
+    """
+
+    def __init__(self, wsgi_app, profile_dir: str, token: str = None,
+                 sample_rate: float = 0.0, max_files: int = 100):
+        """
+        Initialize the middleware.
+
+        Args:
+            wsgi_app: The WSGI application to wrap.
+            profile_dir (str): Directory the .prof files are written to.
+            token (str): Value of the X-Profile-Token header that requests
+                a profile, or None to disable header selection.
+            sample_rate (float): Fraction of requests profiled at random.
+            max_files (int): Number of .prof files kept, oldest removed first.
+        """
+        self._app = wsgi_app
+        self._dir = profile_dir
+        self._token = token.encode('utf-8') if token else None
+        self._sample_rate = sample_rate
+        self._max_files = max_files
+        # cProfile cannot run in two threads at once; concurrent requests
+        # are served unprofiled
+        self._busy = threading.Lock()
+        os.makedirs(profile_dir, exist_ok=True)
+
+    def _selected(self, environ) -> bool:
+        """
+        Determine whether a request should be profiled.
+
+        Args:
+            environ (dict): WSGI environment of the request.
+
+        Returns:
+            bool: True if the request carries the token or is sampled.
+        """
+        if self._token is not None:
+            header = environ.get('HTTP_X_PROFILE_TOKEN')
+            if header is not None and hmac.compare_digest(
+                    header.encode('latin-1'), self._token):
+                return True
+        return self._sample_rate > 0 and random.random() < self._sample_rate
+
+    @staticmethod
+    def _filename(environ, started: float, elapsed: float) -> str:
+        """
+        Build a safe profile file name for a request.
+
+        The method and path are reduced to letters, digits, '_' and '-'
+        and truncated; a hash of the full path keeps names distinct.
+
+        Args:
+            environ (dict): WSGI environment of the request.
+            started (float): Start time of the request.
+            elapsed (float): Duration of the request in seconds.
+
+        Returns:
+            str: The file name, always shorter than 140 characters.
+        """
+        raw_path = environ.get('PATH_INFO', '')
+        method = _UNSAFE.sub('', environ.get('REQUEST_METHOD', ''))[:10]
+        path = _UNSAFE.sub('_', raw_path).strip('_')[:60] or 'root'
+        digest = hashlib.sha1(
+            raw_path.encode('utf-8', 'surrogateescape')).hexdigest()[:8]
+        return '{:.6f}.{}.{}.{}.{:.0f}ms.prof'.format(
+            started, method or 'UNKNOWN', path, digest, elapsed * 1000)
+
+    def _save(self, profiler: cProfile.Profile, environ,
+              started: float, elapsed: float) -> None:
+        """
+        Write a profile and remove the oldest ones beyond max_files.
+        Failures only lose the profile, never the response.
+
+        Args:
+            profiler (cProfile.Profile): The finished profiler.
+            environ (dict): WSGI environment of the request.
+            started (float): Start time of the request.
+            elapsed (float): Duration of the request in seconds.
+        """
+        name = self._filename(environ, started, elapsed)
+        try:
+            profiler.dump_stats(os.path.join(self._dir, name))
+        except (OSError, ValueError):
+            return
+        # Names start with the timestamp, so they sort by age
+        files = sorted(glob.glob(os.path.join(self._dir, '*.prof')))
+        for old in files[:max(len(files) - self._max_files, 0)]:
+            try:
+                os.remove(old)
+            except (OSError, ValueError):
+                pass
+
+    def __call__(self, environ, start_response):
+        """
+        Serve a request, profiling it if selected.
+        """
+        if not self._selected(environ) or not self._busy.acquire(False):
+            return self._app(environ, start_response)
+        try:
+            body = []
+
+            def run():
+                app_iter = self._app(environ, start_response)
+                try:
+                    body.extend(app_iter)
+                finally:
+                    if hasattr(app_iter, 'close'):
+                        app_iter.close()
+
+            profiler = cProfile.Profile()
+            started = time.time()
+            profiler.runcall(run)
+            self._save(profiler, environ, started, time.time() - started)
+        finally:
+            self._busy.release()
+        return body
+
+
+def install_profiler(app) -> None:
+    """
+    Wrap a Flask app in ProfilerMiddleware when PROFILE_DIR is set.
+
+    Requests are profiled when they carry an X-Profile-Token header equal
+    to PROFILE_TOKEN, or at random with probability PROFILE_SAMPLE_RATE.
+    At most PROFILE_MAX_FILES profiles are kept. Without PROFILE_DIR the
+    app is left untouched.
+
+    Args:
+        app: The Flask application.
+    """
+    profile_dir = os.getenv('PROFILE_DIR')
+    if not profile_dir:
+        return
+    app.wsgi_app = ProfilerMiddleware(
+        app.wsgi_app, profile_dir,
+        token=os.getenv('PROFILE_TOKEN'),
+        sample_rate=float(os.getenv('PROFILE_SAMPLE_RATE', 0)),
+        max_files=int(os.getenv('PROFILE_MAX_FILES', 100)))
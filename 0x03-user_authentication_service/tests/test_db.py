@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+Tests for the DB module
+Run from the project directory: python -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy.exc import (  # noqa: E402
+    IntegrityError, InvalidRequestError, OperationalError)
+from sqlalchemy.orm.exc import NoResultFound  # noqa: E402
+
+from db import DB  # noqa: E402
+from user import User  # noqa: E402
+
+
+class DBTestCase(unittest.TestCase):
+    """Runs each test in its own directory, where DB creates its files"""
+
+    def setUp(self) -> None:
+        """Move to a fresh temporary directory"""
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+
+    def tearDown(self) -> None:
+        """Go back to the original directory and clean up"""
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+
+class TestGroupCommit(DBTestCase):
+    """Group commit mode"""
+
+    def test_concurrent_writes_share_commits(self) -> None:
+        """Writes from many threads land in fewer commits"""
+        db = DB(group_commit=True, commit_interval_ms=20)
+        errors = []
+
+        def register(i: int) -> None:
+            try:
+                for j in range(10):
+                    user = db.add_user(f"u{i}_{j}@x", "h")
+                    db.update_user(user.id, session_id=f"s{i}_{j}")
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=register, args=(i,))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        db.close()
+        self.assertEqual(errors, [])
+        self.assertLess(db.commits, 160)
+        for i in range(8):
+            for j in range(10):
+                user = db.find_user_by(email=f"u{i}_{j}@x")
+                self.assertEqual(user.session_id, f"s{i}_{j}")
+
+    def test_commit_failure_raises_in_every_caller(self) -> None:
+        """A failed batch commit is reported to all of its writers"""
+        callers = 6
+        db = DB(group_commit=True, commit_interval_ms=10000,
+                commit_batch_size=callers)
+        session = db._session
+        failure = OperationalError("COMMIT", {}, Exception("disk I/O error"))
+        results = {}
+
+        def register(i: int) -> None:
+            try:
+                db.add_user(f"u{i}@x", "h")
+                results[i] = None
+            except Exception as e:
+                results[i] = e
+
+        with mock.patch.object(session, "commit", side_effect=failure):
+            threads = [threading.Thread(target=register, args=(i,))
+                       for i in range(callers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+        self.assertEqual(len(results), callers)
+        for error in results.values():
+            self.assertIs(error, failure)
+        for i in range(callers):
+            with self.assertRaises(NoResultFound):
+                db.find_user_by(email=f"u{i}@x")
+        # Once closed, writes are committed directly
+        db.close()
+        self.assertEqual(db.add_user("ok@x", "h").email, "ok@x")
+        self.assertEqual(db.find_user_by(email="ok@x").email, "ok@x")
+
+    def test_lock_released_while_waiting(self) -> None:
+        """A writer waiting for its batch does not block other callers"""
+        db = DB(group_commit=True, commit_interval_ms=10000,
+                commit_batch_size=1)
+        reader = db.add_user("r@x", "h")
+        db._shards[0]._commit_batch_size = 100
+        started = time.monotonic()
+        writer = threading.Thread(target=db.add_user, args=("w@x", "h"))
+        writer.start()
+        while db._shards[0]._batch.size == 0:
+            time.sleep(0.001)
+        self.assertEqual(db.find_user_by(email="r@x").id, reader.id)
+        self.assertTrue(writer.is_alive())
+        db.close()
+        writer.join(5)
+        self.assertFalse(writer.is_alive())
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(db.find_user_by(email="w@x").email, "w@x")
+
+    def test_bad_write_fails_alone(self) -> None:
+        """A write violating a constraint raises in its caller only, and
+        neither its batch neighbours nor concurrent readers see it"""
+        db = DB(group_commit=True, commit_interval_ms=10000,
+                commit_batch_size=1)
+        good = db.add_user("good@x", "h")
+        other = db.add_user("other@x", "h")
+        db._shards[0]._commit_batch_size = 100
+        errors = []
+
+        def update() -> None:
+            try:
+                db.update_user(good.id, session_id="s1")
+            except Exception as e:
+                errors.append(e)
+
+        writer = threading.Thread(target=update)
+        writer.start()
+        while db._shards[0]._batch.size == 0:
+            time.sleep(0.001)
+        with self.assertRaises(IntegrityError):
+            db.update_user(other.id, hashed_password=None)
+        with self.assertRaises(IntegrityError):
+            db.add_user("null@x", None)
+        self.assertEqual(db.find_user_by(email="good@x").id, good.id)
+        self.assertEqual(db.find_user_by(email="other@x").hashed_password,
+                         "h")
+        with self.assertRaises(NoResultFound):
+            db.find_user_by(email="null@x")
+        self.assertTrue(writer.is_alive())
+        db.close()
+        writer.join(5)
+        self.assertEqual(errors, [])
+        self.assertEqual(db.find_user_by(id=good.id).session_id, "s1")
+        self.assertEqual(db.find_user_by(id=other.id).hashed_password, "h")
+
+    def test_bad_writes_under_concurrency(self) -> None:
+        """Concurrent good and bad writes sharing batches only fail the
+        bad ones, and readers keep working meanwhile"""
+        db = DB(group_commit=True, commit_interval_ms=20)
+        errors = {}
+        lock = threading.Lock()
+
+        def register(i: int) -> None:
+            for j in range(10):
+                bad = j % 3 == 0
+                try:
+                    user = db.add_user(f"u{i}_{j}@x", None if bad else "h")
+                    db.update_user(user.id, session_id=f"s{i}_{j}")
+                    db.find_user_by(email=f"u{i}_{j}@x")
+                except Exception as e:
+                    with lock:
+                        errors[(i, j)] = e
+
+        threads = [threading.Thread(target=register, args=(i,))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        db.close()
+        self.assertEqual(sorted(errors), [(i, j) for i in range(8)
+                                          for j in range(10) if j % 3 == 0])
+        for error in errors.values():
+            self.assertIsInstance(error, IntegrityError)
+        for i in range(8):
+            for j in range(10):
+                if j % 3:
+                    user = db.find_user_by(email=f"u{i}_{j}@x")
+                    self.assertEqual(user.session_id, f"s{i}_{j}")
+                else:
+                    with self.assertRaises(NoResultFound):
+                        db.find_user_by(email=f"u{i}_{j}@x")
+
+
+class TestLookupCache(DBTestCase):
+    """Cached lookup statements"""
+
+    def test_shapes_match_filter_by(self) -> None:
+        """Alternating lookup shapes give the same users as filter_by"""
+        db = DB()
+        for i in range(10):
+            user = db.add_user(f"u{i}@x", "h")
+            if i % 2:
+                db.update_user(user.id, session_id=f"s{i}")
+        session = db._session
+        shapes = [
+            lambda i: {"email": f"u{i}@x"},
+            lambda i: {"id": i + 1},
+            lambda i: {"session_id": f"s{i}"},
+            lambda i: {"email": f"u{i}@x", "session_id": None},
+            lambda i: {"session_id": f"s{i}", "email": f"u{i}@x"},
+            lambda i: {"email": f"u{i}@x", "hashed_password": "h"},
+        ]
+        for _ in range(3):
+            for i in range(11):
+                for shape in shapes:
+                    kwargs = shape(i)
+                    expected = session.query(User).filter_by(**kwargs).all()
+                    try:
+                        found = [db.find_user_by(**kwargs)]
+                    except NoResultFound:
+                        found = []
+                    self.assertEqual(found, expected, kwargs)
+        self.assertEqual(set(db._lookups), {
+            (("email",), None), (("id",), None), (("session_id",), None),
+            (("email", "session_id"), None),
+            (("email", "hashed_password"), None)})
+
+    def test_limit_is_part_of_the_key(self) -> None:
+        """Queries over every shard, limited to two rows, do not share a
+        statement with the unlimited single-shard ones"""
+        db = DB(shards=2)
+        users = [db.add_user(f"u{i}@x", "h") for i in range(6)]
+        for user in users:
+            db.update_user(user.id, session_id=f"s{user.id}")
+            self.assertEqual(db.find_user_by(session_id=f"s{user.id}").id,
+                             user.id)
+            self.assertEqual(db.find_user_by(id=user.id).id, user.id)
+        self.assertEqual(set(db._lookups), {
+            (("id",), None), (("session_id",), 2)})
+        with self.assertRaises(InvalidRequestError):
+            db.find_user_by(hashed_password="h")
+        self.assertIn((("hashed_password",), 2), db._lookups)
+
+
+class TestEmailFilter(DBTestCase):
+    """Bloom filter in front of email lookups"""
+
+    def count_statements(self, db: DB) -> list:
+        """Record the SQL statements run on every shard"""
+        statements = []
+        for shard in db._shards:
+            event.listen(shard._engine, "before_cursor_execute",
+                         lambda conn, cursor, statement, *args:
+                         statements.append(statement))
+        return statements
+
+    def test_miss_avoids_query(self) -> None:
+        """An unknown email is answered without a query and counted"""
+        db = DB()
+        db.add_user("known@x", "h")
+        statements = self.count_statements(db)
+        for _ in range(3):
+            with self.assertRaises(NoResultFound):
+                db.find_user_by(email="unknown@x")
+        self.assertEqual(statements, [])
+        self.assertEqual(db.queries_avoided, 3)
+        self.assertEqual(db.find_user_by(email="known@x").email, "known@x")
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(db.queries_avoided, 3)
+
+    def test_hit_after_add(self) -> None:
+        """Added emails are found, whatever the write mode"""
+        for options in ({}, {"group_commit": True},
+                        {"shards": 4}, {"shards": 4, "group_commit": True}):
+            db = DB(**options)
+            for i in range(20):
+                with self.assertRaises(NoResultFound):
+                    db.find_user_by(email=f"u{i}@x")
+                user = db.add_user(f"u{i}@x", "h")
+                self.assertEqual(db.find_user_by(email=f"u{i}@x").id,
+                                 user.id, options)
+                self.assertEqual(db.find_user_by(email=f"u{i}@x",
+                                                 id=user.id).id, user.id)
+            self.assertEqual(db.queries_avoided, 20, options)
+            db.close()
+
+    def test_hit_after_email_change(self) -> None:
+        """A new email set by update_user is found"""
+        db = DB()
+        user = db.add_user("old@x", "h")
+        db.update_user(user.id, email="new@x")
+        self.assertEqual(db.find_user_by(email="new@x").id, user.id)
+        with self.assertRaises(NoResultFound):
+            db.find_user_by(email="old@x")
+        self.assertEqual(db.queries_avoided, 0)
+
+    def test_disabled(self) -> None:
+        """email_filter_bits=0 queries for every lookup"""
+        db = DB(email_filter_bits=0)
+        statements = self.count_statements(db)
+        with self.assertRaises(NoResultFound):
+            db.find_user_by(email="unknown@x")
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(db.queries_avoided, 0)
+
+    def test_unknown_column(self) -> None:
+        """An unknown column is an error even for an unknown email"""
+        db = DB()
+        with self.assertRaises(InvalidRequestError):
+            db.find_user_by(email="unknown@x", no_such_column=1)
+        self.assertEqual(db.queries_avoided, 0)
+
+    def test_count_under_concurrency(self) -> None:
+        """Misses from many threads are all counted"""
+        db = DB(shards=2)
+
+        def miss(i: int) -> None:
+            for j in range(500):
+                try:
+                    db.find_user_by(email=f"missing{i}_{j}@x")
+                except NoResultFound:
+                    pass
+
+        threads = [threading.Thread(target=miss, args=(i,))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(db.queries_avoided, 4000)
+
+
+class TestShards(DBTestCase):
+    """Sharded mode"""
+
+    def test_files_and_routing(self) -> None:
+        """Users land in the shard of their email and are found by email,
+        by id and by any other column"""
+        db = DB(shards=4)
+        self.assertEqual(sorted(f for f in os.listdir('.')
+                                if f.endswith('.db')),
+                         ['a_0.db', 'a_1.db', 'a_2.db', 'a_3.db'])
+        users = [db.add_user(f"user{i}@x", "h") for i in range(40)]
+        for user in users:
+            shard = db._shard_for_email(user.email)
+            self.assertIs(db._shard_for_id(user.id), shard)
+            with shard.lock:
+                stored = shard.session.query(type(user)).filter_by(
+                    email=user.email).one()
+            self.assertEqual(stored.id, user.id)
+            self.assertEqual(db.find_user_by(email=user.email).id, user.id)
+            self.assertEqual(db.find_user_by(id=user.id).email, user.email)
+        self.assertGreater(len({db._shard_for_email(u.email)
+                                for u in users}), 1)
+        db.update_user(users[7].id, session_id="abc")
+        self.assertEqual(db.find_user_by(session_id="abc").id, users[7].id)
+        with self.assertRaises(NoResultFound):
+            db.find_user_by(session_id="missing")
+        with self.assertRaises(InvalidRequestError):
+            db.find_user_by(hashed_password="h")
+        with self.assertRaises(InvalidRequestError):
+            db.find_user_by(no_such_column=1)
+
+    def test_ids_unique_under_concurrency(self) -> None:
+        """Ids stay unique across shards with concurrent registrations"""
+        db = DB(shards=3)
+        ids = []
+        lock = threading.Lock()
+
+        def register(i: int) -> None:
+            for j in range(25):
+                user = db.add_user(f"u{i}_{j}@x", "h")
+                with lock:
+                    ids.append(user.id)
+
+        threads = [threading.Thread(target=register, args=(i,))
+                   for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(ids), 150)
+        self.assertEqual(len(set(ids)), 150)
+
+    def test_update_email_across_shards(self) -> None:
+        """An email change is allowed within a shard only"""
+        db = DB(shards=4)
+        user = db.add_user("owner@x", "h")
+        shard = db._shard_for_email("owner@x")
+        same = next(f"same{i}@x" for i in range(1000)
+                    if db._shard_for_email(f"same{i}@x") is shard)
+        other = next(f"other{i}@x" for i in range(1000)
+                     if db._shard_for_email(f"other{i}@x") is not shard)
+        with self.assertRaises(ValueError):
+            db.update_user(user.id, email=other)
+        self.assertEqual(db.find_user_by(id=user.id).email, "owner@x")
+        with self.assertRaises(NoResultFound):
+            db.find_user_by(email=other)
+        db.update_user(user.id, email=same)
+        self.assertEqual(db.find_user_by(email=same).id, user.id)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Regression tests for the per-request profiling hook
+Run from the project directory: python -m unittest discover tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from profiling import ProfilerMiddleware  # noqa: E402
+
+
+class TestProfilerMiddleware(unittest.TestCase):
+    """Profiled requests get the same response as unprofiled ones"""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        """Import the app from a temporary directory, where it creates
+        its database"""
+        cls._cwd = os.getcwd()
+        cls._tmp = tempfile.TemporaryDirectory()
+        os.chdir(cls._tmp.name)
+        from app import app
+        cls.app = app
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        """Go back to the original directory and clean up"""
+        os.chdir(cls._cwd)
+        cls._tmp.cleanup()
+
+    def setUp(self) -> None:
+        """Profile every request into a fresh directory"""
+        self._wsgi_app = self.app.wsgi_app
+        self.profile_dir = tempfile.mkdtemp()
+        self.app.wsgi_app = ProfilerMiddleware(
+            self._wsgi_app, self.profile_dir, sample_rate=1.0)
+        self.client = self.app.test_client()
+
+    def tearDown(self) -> None:
+        """Restore the app and remove the profiles"""
+        self.app.wsgi_app = self._wsgi_app
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+    def test_unsafe_paths(self) -> None:
+        """Long paths and NUL bytes give the normal 404 and a safe name"""
+        for path in ('/' + 'a' * 300, '/%00x', '/../x/..'):
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 404, path)
+        names = os.listdir(self.profile_dir)
+        self.assertEqual(len(names), 3)
+        for name in names:
+            self.assertLess(len(name), 140)
+            self.assertRegex(name, r'^[0-9]+\.[0-9]+\.[A-Za-z0-9_.-]+\.prof$')
+
+    def test_unwritable_directory(self) -> None:
+        """A missing profile directory loses the profile, not the response"""
+        shutil.rmtree(self.profile_dir)
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {"message": "Bienvenue"})
+
+
+if __name__ == "__main__":
+    unittest.main()